@@ -116,6 +116,22 @@ class BaseNParser(BaseLeplParser):
     def make_named_node(self, values):
         return self.env.createNamedNode(normalize_iri(nt_unescape(values[0])))
 
+    def parse_lines(self, lines, sink = None):
+        """Parse an iterable of lines one at a time, so that the document never
+        has to be held in memory all at once. sink may be anything with an add
+        method."""
+        if sink is None:
+            sink = self._make_graph()
+        self._prepare_parse(sink)
+        try:
+            for line in lines:
+                if not line.endswith('\n'):
+                    line += '\n'
+                self.line.parse(line)
+        finally:
+            self._cleanup_parse()
+        return sink
+
     def make_language_literal(self, values):
         if len(values) == 2:
             return self.env.createLiteral(value = nt_unescape(values[0]),
@@ -136,6 +152,9 @@ class NTriplesParser(BaseNParser):
             & ~Star(Space()) >= self.make_triple
         self.line = Star(Space()) & Optional(~self.triple | ~self.comment) & \
             ~Literal('\n')
+        # Memoizing would skip adding a statement from a line that repeats one
+        # parsed before, see parse_lines.
+        self.line.config.no_memoize()
         self.document = Star(self.line)
 
     def _make_graph(self):
@@ -160,6 +179,9 @@ class NQuadsParser(BaseNParser):
             & ~Star(Space()) & ~Literal('.') & ~Star(Space()) >= self.make_quad
         self.line = Star(Space()) & Optional(~self.quad | ~self.comment) \
             & ~Literal('\n')
+        # Memoizing would skip adding a statement from a line that repeats one
+        # parsed before, see parse_lines.
+        self.line.config.no_memoize()
         self.document = Star(self.line)
 
     def _make_graph(self):
@@ -1,28 +1,1676 @@
 """Provide an interface to SPARQL query endpoints."""
 
+import array
+import base64
+import codecs
+import copy
+from collections import Counter, defaultdict, namedtuple, OrderedDict
 from cStringIO import StringIO
+import csv
 import datetime
+import httplib
+import Queue
+import random
+import re
+import select
+import socket
+import sys
+import threading
+import time
 import urllib
 import urlparse
+import uuid
+import zlib
 
 import httplib2
-from lxml import objectify
+from lxml import etree, objectify
 import pytz
 import rdflib
 import simplejson
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pymantic.parsers import nquads_parser, nt_unescape, ntriples_parser
+from pymantic.primitives import BlankNode, Literal, NamedNode, XSD
+from pymantic.uri_schemes import schemes
+
 import logging
 
 log = logging.getLogger(__name__)
 
 class SPARQLQueryException(Exception):
-    """Raised when the SPARQL store returns an HTTP status code other than 200 OK."""
-    pass
+    """Raised when the SPARQL store returns an HTTP status code other than 200 OK.
+    The status code is available as status, if known."""
+
+    def __init__(self, message='', status=None):
+        super(SPARQLQueryException, self).__init__(message)
+        self.status = status
 
 class UnknownSPARQLReturnTypeException(Exception):
     """Raised when the SPARQL store provides a response with an unrecognized content-type."""
     pass
 
+class ConnectionPoolException(Exception):
+    """Raised when no pooled connection becomes free within the pool's wait."""
+    pass
+
+class DeadlineExceededException(SPARQLQueryException):
+    """Raised when a request is abandoned because its :class:`Deadline`
+    passed before the response was read."""
+    pass
+
+class Deadline(object):
+    """A client-side time limit on a request sent through a
+    :class:`ConnectionPool`.
+
+    When the time is up the socket of the request's connection is shut down,
+    which wakes up the thread blocked reading from it, and on_expire (eg.
+    to cancel a query on the server) is called from a timer thread. A new
+    connection is given a timeout of the time left while it connects and
+    sends the request, as there is no socket to shut down until it has
+    connected. The request then fails with
+    :class:`DeadlineExceededException`.
+
+    :param seconds: How long the request may take.
+    :param on_expire: Called with no arguments when the deadline passes."""
+
+    def __init__(self, seconds, on_expire=None):
+        self.seconds = seconds
+        self.on_expire = on_expire
+        self.expires = None
+        self.expired = False
+        self.stopped = False
+        self.connection = None
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def start(self, expires=None):
+        """Start the clock, which runs out seconds from now or, for a retry
+        sharing the deadline of an earlier attempt, at the time expires."""
+        self.expires = expires if expires is not None else \
+            time.time() + self.seconds
+        self._timer = threading.Timer(max(0, self.expires - time.time()),
+                                      self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+        return self
+
+    def watch(self, connection):
+        """Abort connection, rather than any earlier one, when time is up."""
+        with self._lock:
+            if self.expired:
+                raise self.exception()
+            self.connection = connection
+
+    def remaining(self):
+        """Seconds until the deadline passes, which may be negative."""
+        return self.expires - time.time()
+
+    def stop(self):
+        """Stop the clock. Returns False if the deadline had already passed,
+        when the connection can't be reused."""
+        with self._lock:
+            self.stopped = True
+        if self._timer is not None:
+            self._timer.cancel()
+        return not self.expired
+
+    def exception(self):
+        return DeadlineExceededException('No response within %ss' %
+                                         self.seconds)
+
+    def _expire(self):
+        with self._lock:
+            if self.stopped:
+                return
+            self.expired = True
+            connection = self.connection
+        sock = getattr(connection, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        if self.on_expire is not None:
+            try:
+                self.on_expire()
+            except Exception:
+                log.exception('Error handling expired deadline')
+
+class _DeflateDecoder(object):
+    """Decompresses a deflate content-encoding, which should be zlib
+    wrapped but which some servers send raw."""
+
+    def __init__(self):
+        self._decoder = zlib.decompressobj()
+        self._header = ''
+
+    def decompress(self, data):
+        if self._header is None:
+            return self._decoder.decompress(data)
+        # Until the two byte zlib header has been checked.
+        self._header += data
+        try:
+            data = self._decoder.decompress(data)
+        except zlib.error:
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = self._decoder.decompress(self._header)
+        if len(self._header) >= 2:
+            self._header = None
+        return data
+
+    def flush(self):
+        return self._decoder.flush()
+
+class PooledResponse(object):
+    """A streamed HTTP response from a :class:`ConnectionPool`.
+
+    The body is read on demand with :meth:`read`, :meth:`readline` or by
+    iterating over its lines. Closing the response hands its connection back
+    to the pool if the body was read to the end, and drops it otherwise.
+
+    A gzip or deflate encoded body is decompressed as it is read; as with
+    httplib2, its content-encoding header is then renamed
+    -content-encoding."""
+
+    decoders = {
+        'gzip': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+        'x-gzip': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+        'deflate': _DeflateDecoder,
+    }
+
+    def __init__(self, pool, key, connection, response, deadline=None):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.deadline = deadline
+        self.status = response.status
+        self.headers = httplib2.Response(response)
+        self._response = response
+        self._buffer = ''
+        self._decoder = None
+        encoding = self.headers.get('content-encoding', '').strip().lower()
+        if encoding in self.decoders:
+            self._decoder = self.decoders[encoding]()
+            self.headers['-content-encoding'] = \
+                self.headers.pop('content-encoding')
+
+    def _read_raw(self, amt=None):
+        try:
+            data = self._response.read(amt)
+        except Exception:
+            if self.deadline is not None and self.deadline.expired:
+                raise self.deadline.exception()
+            raise
+        self.pool.count('bytes_received', len(data))
+        return data
+
+    def _read(self, amt=None):
+        if self._decoder is None:
+            return self._read_raw(amt)
+        while True:
+            data = self._read_raw(amt)
+            if not data:
+                data = self._decoder.flush()
+            else:
+                data = self._decoder.decompress(data)
+                if amt is None:
+                    data += self._decoder.flush()
+                elif not data:
+                    continue
+            self.pool.count('bytes_decoded', len(data))
+            return data
+
+    def read(self, amt=None):
+        if self._response is None:
+            return ''
+        if amt is None:
+            data = self._buffer + self._read()
+            self._buffer = ''
+            return data
+        if not self._buffer:
+            self._buffer = self._read(amt)
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def readline(self, chunk_size=8192):
+        while '\n' not in self._buffer:
+            data = self._read(chunk_size) if self._response else ''
+            if not data:
+                line, self._buffer = self._buffer, ''
+                return line
+            self._buffer += data
+        line, self._buffer = self._buffer.split('\n', 1)
+        return line + '\n'
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def close(self):
+        """Finish with this response, returning its connection to the pool."""
+        if self._response is None:
+            return
+        finished = self.deadline is None or self.deadline.stop()
+        if finished and self._response.isclosed() and not self._buffer:
+            self.pool.release(self.key, self.connection)
+        else:
+            self.pool.discard(self.key, self.connection)
+        self._response = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ConnectionPool(object):
+    """A bounded, thread-safe pool of persistent (keep-alive) HTTP connections.
+
+    Connections are kept per host and handed back out to later requests
+    against the same host, so repeated requests don't each pay for a new TCP
+    (and TLS) handshake. A single pool may be shared by any number of
+    :class:`SPARQLServer` instances.
+
+    :param max_size: The most connections, idle or busy, the pool will hold.
+    :param max_per_host: The most connections the pool will hold to any one
+        host, or None for no limit beyond max_size.
+    :param max_idle: Seconds an idle connection may sit in the pool before it
+        is closed.
+    :param timeout: Socket timeout in seconds for new connections.
+    :param wait: Seconds to wait for a free connection when the pool is full
+        before raising :class:`ConnectionPoolException`, or None to wait
+        forever.
+    :param accept_encoding: The Accept-Encoding header to send with requests
+        that don't set their own, or None to ask for uncompressed responses.
+    :param proxies: Proxy URLs by scheme, as from urllib.getproxies, which
+        (reading http_proxy, https_proxy and no_proxy from the environment)
+        they default to. HTTPS is tunnelled through the proxy with CONNECT.
+
+    GET and HEAD requests follow up to max_redirects redirects, as
+    httplib2 does. The body bytes sent and received on the wire, and received after
+    decompression, are counted in counters as bytes_sent, bytes_received
+    and bytes_decoded."""
+
+    connection_classes = {
+        'http': httplib.HTTPConnection,
+        'https': httplib.HTTPSConnection,
+    }
+
+    # Errors sending a request over a kept-alive connection that mean the
+    # server had closed it before we reused it.
+    stale_connection_errors = (httplib.CannotSendRequest, socket.error)
+
+    redirect_statuses = frozenset([301, 302, 303, 307, 308])
+    max_redirects = 5
+
+    def __init__(self, max_size=10, max_per_host=None, max_idle=60,
+                 timeout=None, wait=None, accept_encoding='gzip, deflate',
+                 proxies=None):
+        self.proxies = proxies if proxies is not None else urllib.getproxies()
+        self.max_size = max_size
+        self.max_per_host = max_per_host
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.wait = wait
+        self.accept_encoding = accept_encoding
+        self.counters = Counter()
+        self._counters_lock = threading.Lock()
+        self._lock = threading.Condition()
+        self._idle = defaultdict(list)
+        self._per_host = defaultdict(int)
+        self._size = 0
+
+    @staticmethod
+    def host_key(uri):
+        """The (scheme, netloc) pair that connections to uri are pooled under."""
+        parts = urlparse.urlsplit(uri)
+        return parts.scheme, parts.netloc
+
+    @staticmethod
+    def is_stale(connection):
+        """Whether an idle connection has been closed by the server. An idle
+        socket with anything to read has either reached EOF or been sent
+        something we didn't ask for; either way it can't be reused."""
+        if connection.sock is None:
+            return False
+        try:
+            return bool(select.select([connection.sock], [], [], 0)[0])
+        except (select.error, socket.error, ValueError):
+            return True
+
+    def proxy_for(self, key):
+        """The (netloc, Proxy-Authorization header or None) of the proxy to
+        connect to key through, or None to connect directly."""
+        scheme, netloc = key
+        proxy = self.proxies.get(scheme)
+        if not proxy or urllib.proxy_bypass(netloc):
+            return None
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        parts = urlparse.urlsplit(proxy)
+        authorization = None
+        if parts.username is not None:
+            authorization = 'Basic ' + base64.b64encode('%s:%s' % (
+                urllib.unquote(parts.username),
+                urllib.unquote(parts.password or '')))
+        return parts.netloc.rpartition('@')[2], authorization
+
+    def _connect(self, key):
+        scheme, netloc = key
+        proxy = self.proxy_for(key)
+        if proxy is None:
+            return self.connection_classes[scheme](netloc, timeout=self.timeout)
+        proxy_netloc, authorization = proxy
+        headers = {'Proxy-Authorization': authorization} \
+            if authorization else None
+        if scheme == 'http':
+            # Requests go to the proxy with absolute URIs; see urlopen.
+            connection = httplib.HTTPConnection(proxy_netloc,
+                                                timeout=self.timeout)
+            connection.proxy_headers = headers or {}
+            return connection
+        connection = self.connection_classes[scheme](proxy_netloc,
+                                                     timeout=self.timeout)
+        connection.set_tunnel(netloc, headers=headers)
+        return connection
+
+    def _evict_idle(self, now):
+        for key, idle in self._idle.items():
+            while idle and now - idle[0][0] >= self.max_idle:
+                self._close(key, idle.pop(0)[1])
+            if not idle:
+                del self._idle[key]
+
+    def _evict_oldest(self):
+        oldest = None
+        for key, idle in self._idle.iteritems():
+            if idle and (oldest is None or idle[0][0] < oldest[1]):
+                oldest = (key, idle[0][0])
+        if oldest is not None:
+            key = oldest[0]
+            self._close(key, self._idle[key].pop(0)[1])
+            if not self._idle[key]:
+                del self._idle[key]
+
+    def _close(self, key, connection):
+        connection.close()
+        self._forget(key)
+
+    def _forget(self, key):
+        self._size -= 1
+        self._per_host[key] -= 1
+        if not self._per_host[key]:
+            del self._per_host[key]
+        self._lock.notify_all()
+
+    def acquire(self, key):
+        """Take a connection to the host key from the pool, opening a new one
+        if none is idle. Returns a (connection, reused) pair."""
+        deadline = None if self.wait is None else time.time() + self.wait
+        with self._lock:
+            while True:
+                now = time.time()
+                self._evict_idle(now)
+                while self._idle.get(key):
+                    connection = self._idle[key].pop()[1]
+                    if not self.is_stale(connection):
+                        return connection, True
+                    self._close(key, connection)
+                if self.max_per_host is None or \
+                   self._per_host[key] < self.max_per_host:
+                    if self._size >= self.max_size:
+                        self._evict_oldest()
+                    if self._size < self.max_size:
+                        self._size += 1
+                        self._per_host[key] += 1
+                        break
+                if deadline is not None and now >= deadline:
+                    raise ConnectionPoolException(
+                        'Timed out waiting for a connection to %s://%s' % key)
+                self._lock.wait(None if deadline is None else deadline - now)
+        try:
+            return self._connect(key), False
+        except Exception:
+            with self._lock:
+                self._forget(key)
+            raise
+
+    def release(self, key, connection):
+        """Return a connection to the pool for reuse."""
+        with self._lock:
+            self._idle[key].append((time.time(), connection))
+            self._lock.notify_all()
+
+    def discard(self, key, connection):
+        """Close a connection and free its place in the pool."""
+        with self._lock:
+            self._close(key, connection)
+
+    def clear(self):
+        """Close every idle connection in the pool."""
+        with self._lock:
+            for key, idle in self._idle.items():
+                for last_used, connection in idle:
+                    self._close(key, connection)
+            self._idle.clear()
+
+    def count(self, counter, n):
+        with self._counters_lock:
+            self.counters[counter] += n
+
+    def _counted(self, chunks):
+        for chunk in chunks:
+            self.count('bytes_sent', len(chunk))
+            yield chunk
+
+    @staticmethod
+    def send_chunked(connection, method, path, chunks, headers):
+        """Send a request whose body is streamed from an iterable of strings
+        using chunked transfer encoding."""
+        connection.putrequest(method, path)
+        for name, value in headers.iteritems():
+            connection.putheader(name, value)
+        connection.putheader('Transfer-Encoding', 'chunked')
+        connection.endheaders()
+        for chunk in chunks:
+            if chunk:
+                connection.send('%X\r\n%s\r\n' % (len(chunk), chunk))
+        connection.send('0\r\n\r\n')
+
+    def urlopen(self, uri, method='GET', body=None, headers=None,
+                deadline=None):
+        """Send a request over a pooled connection and return a
+        :class:`PooledResponse` whose body has not been read yet. body may be
+        a string, or an iterable of strings to send chunked. deadline is a
+        started :class:`Deadline`, stopped when the response is closed."""
+        redirects = 0
+        while True:
+            response = self._open(uri, method, body, headers, deadline)
+            location = response.headers.get('location')
+            if method not in ('GET', 'HEAD') or not location or \
+               response.status not in self.redirect_statuses or \
+               redirects == self.max_redirects:
+                return response
+            try:
+                response.read()
+            finally:
+                # Keep the clock running for the redirected request.
+                if deadline is not None and not deadline.expired:
+                    response.deadline = None
+                    deadline.connection = None
+                response.close()
+            uri = urlparse.urljoin(uri, location)
+            redirects += 1
+
+    def _open(self, uri, method, body, headers, deadline):
+        key = self.host_key(uri)
+        parts = urlparse.urlsplit(uri)
+        path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        headers = dict(headers or {})
+        if self.accept_encoding and not any(
+                name.lower() == 'accept-encoding' for name in headers):
+            headers['Accept-Encoding'] = self.accept_encoding
+        if body is not None and not isinstance(body, basestring):
+            body = self._counted(body)
+        while True:
+            connection, reused = self.acquire(key)
+            if getattr(connection, 'proxy_headers', None) is not None:
+                path = urlparse.urlunsplit(parts[:4] + ('',))
+                headers.update(connection.proxy_headers)
+            sent = False
+            try:
+                if deadline is not None:
+                    deadline.watch(connection)
+                    if connection.sock is None:
+                        # The deadline can't abort a connect, which has no
+                        # socket to shut down yet, so time it out instead.
+                        connection.timeout = deadline.remaining() \
+                            if self.timeout is None else \
+                            min(self.timeout, deadline.remaining())
+                if body is None or isinstance(body, basestring):
+                    connection.request(method, path, body, headers)
+                    self.count('bytes_sent', len(body or ''))
+                else:
+                    self.send_chunked(connection, method, path, body, headers)
+                sent = True
+                if connection.timeout != self.timeout:
+                    connection.timeout = self.timeout
+                    connection.sock.settimeout(self.timeout)
+                response = connection.getresponse()
+            except Exception as e:
+                self.discard(key, connection)
+                if deadline is not None and (deadline.expired or
+                                             deadline.remaining() <= 0):
+                    deadline.stop()
+                    raise deadline.exception()
+                if reused and self._stale(e, sent) and \
+                   (body is None or isinstance(body, basestring)):
+                    continue
+                if deadline is not None:
+                    deadline.stop()
+                raise
+            return PooledResponse(self, key, connection, response, deadline)
+
+    def _stale(self, error, sent):
+        """Whether error, from a reused connection, shows that the server had
+        already closed it, so that the request can't have been acted on and
+        may be resent whether or not it is idempotent. Anything else, such
+        as a timeout or a reset while waiting for the response, is left to
+        the caller's :class:`RetryPolicy`."""
+        if isinstance(error, socket.timeout):
+            return False
+        if isinstance(error, httplib.BadStatusLine):
+            # The connection was closed without a byte of response, which
+            # httplib reports with an empty line or, in later 2.7 releases, an
+            # explanatory one.
+            return not error.line or \
+                error.line.startswith('No status line received')
+        return not sent and isinstance(error, self.stale_connection_errors)
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                deadline=None):
+        """Send a request over a pooled connection, in the manner of
+        httplib2.Http.request. Returns a (response, content) pair."""
+        response = self.urlopen(uri, method, body, headers, deadline)
+        try:
+            content = response.read()
+        except Exception:
+            response.close()
+            raise
+        response.close()
+        return response.headers, content
+
+class TermDecoder(object):
+    """Decodes the bindings of one SPARQL result set into rows of
+    :mod:`pymantic.primitives` terms.
+
+    Each row is a tuple subclass (with empty __slots__) holding a term, or
+    None where unbound, for each of vars in order. IRIs, datatypes and
+    language tags are interned, so every row shares one instance of each
+    rather than holding its own copy, and each blank node label decodes to
+    a single BlankNode. Use one decoder per result set, eg. for the
+    dictionary returned by :meth:`SPARQLServer.query`::
+
+        decoder = TermDecoder(results['head']['vars'])
+        rows = [decoder.row(b) for b in results['results']['bindings']]
+    """
+
+    def __init__(self, vars):
+        self.vars = vars
+        self.row_class = namedtuple(
+            'Row', [var.encode('ascii', 'replace') for var in vars], rename=True)
+        self._named_nodes = {}
+        self._blank_nodes = {}
+        self._languages = {}
+
+    def named_node(self, iri):
+        try:
+            return self._named_nodes[iri]
+        except KeyError:
+            node = self._named_nodes[iri] = NamedNode(iri)
+            return node
+
+    def blank_node(self, label):
+        try:
+            return self._blank_nodes[label]
+        except KeyError:
+            node = self._blank_nodes[label] = BlankNode()
+            return node
+
+    def term(self, value):
+        """Decode a single bound value."""
+        type = value['type']
+        if type == 'uri':
+            return self.named_node(value['value'])
+        elif type == 'literal' or type == 'typed-literal':
+            language = value.get('xml:lang')
+            if language is not None:
+                language = self._languages.setdefault(language, language)
+            datatype = value.get('datatype')
+            if datatype is not None:
+                datatype = self.named_node(datatype)
+            return Literal(value['value'], language, datatype)
+        elif type == 'bnode':
+            return self.blank_node(value['value'])
+        raise ValueError('Unknown SPARQL result term type: %r' % type)
+
+    def row(self, binding):
+        """Decode a binding into a row."""
+        term = self.term
+        return self.row_class._make([None if value is None else term(value)
+                                     for value in map(binding.get, self.vars)])
+
+class Future(object):
+    """The eventual result of a call submitted to a :class:`WorkerPool`.
+    Callbacks added with :meth:`add_done_callback` have all run by the time
+    :meth:`result` returns."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._finished = False
+        self._finishing_thread = None
+        self._lock = threading.Lock()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done.is_set()
+
+    def _wait(self, timeout):
+        # Callbacks can see the outcome before waiters are woken; other
+        # threads wait for the callbacks to finish.
+        if self._finishing_thread is threading.current_thread():
+            return
+        if not self._done.wait(timeout):
+            raise RuntimeError('Timed out waiting for a result')
+
+    def result(self, timeout=None):
+        """Wait for the call to finish and return its result, or raise its
+        exception."""
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for the call to finish and return the exception it raised, if
+        any."""
+        self._wait(timeout)
+        return self._exc_info[1] if self._exc_info is not None else None
+
+    def add_done_callback(self, callback):
+        """Call callback with this future once it is done."""
+        with self._lock:
+            if not self._finished:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _finish(self, result=None, exc_info=None):
+        with self._lock:
+            self._result = result
+            self._exc_info = exc_info
+            self._finished = True
+            self._finishing_thread = threading.current_thread()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                log.exception('Error in callback of %r', self)
+        self._done.set()
+
+class WorkerPool(object):
+    """Runs calls concurrently on a fixed number of daemon threads.
+
+    :param workers: The number of threads, which is the most calls that will
+        run at once.
+    :param queue_size: The most calls that may wait for a thread before
+        :meth:`submit` blocks, or 0 for no limit."""
+
+    def __init__(self, workers=10, queue_size=0):
+        self.workers = workers
+        self._queue = Queue.Queue(queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            future, fn, args, kwargs = task
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                future._finish(exc_info=sys.exc_info())
+            else:
+                future._finish(result)
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule fn(*args, **kwargs) and return a :class:`Future` for it."""
+        if len(self._threads) < self.workers:
+            self._start()
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def map(self, fn, *iterables):
+        """Like the builtin map, but calls fn concurrently. Returns the results
+        in order, raising the first exception met, if any."""
+        futures = [self.submit(fn, *args) for args in zip(*iterables)]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        """Stop the threads once the calls already submitted have run."""
+        with self._lock:
+            for thread in self._threads:
+                self._queue.put(None)
+            self._threads = []
+
+class SPARQLResults(object):
+    """The streamed results of a SPARQL SELECT or ASK query.
+
+    Iterating over a SPARQLResults yields one binding at a time, in the
+    shape of the application/sparql-results+json bindings (a dictionary from
+    variable name to a dictionary with 'type', 'value' and, for literals,
+    'xml:lang' or 'datatype'), while the response is read as it arrives.
+    The variable names in vars are available before the first binding, and
+    ASK queries set boolean instead of yielding bindings. Results can only be
+    iterated over once; close them (or use them as a context manager) to
+    return the connection to its pool if they aren't read to the end.
+
+    Setting decoder to a :class:`TermDecoder` yields decoded rows of terms
+    instead of bindings."""
+
+    def __init__(self, f):
+        self.f = f
+        self.decoder = None
+        self.vars = []
+        self.link = []
+        self.boolean = None
+        self._done = False
+        self._bindings = self.parse()
+        self._next = self._advance()
+
+    def parse(self):
+        """Generate bindings from f; an abstract method."""
+        raise NotImplementedError
+
+    def _advance(self):
+        binding = next(self._bindings, None)
+        if binding is None:
+            self._done = True
+        return binding
+
+    def __iter__(self):
+        try:
+            while self._next is not None:
+                binding = self._next
+                self._next = self._advance()
+                if self.decoder is not None:
+                    yield self.decoder.row(binding)
+                else:
+                    yield binding
+        finally:
+            self.close()
+
+    def close(self):
+        if self._done:
+            # Parsed to the end, so drain any trailing whitespace to let the
+            # connection be reused.
+            while self.f.read(8192):
+                pass
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class JSONResults(SPARQLResults):
+    """Incrementally parses an application/sparql-results+json document.
+
+    Only one binding is decoded at a time, so memory use doesn't grow with
+    the size of the result set."""
+
+    whitespace = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, f, chunk_size=65536):
+        self.chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = simplejson.JSONDecoder()
+        self._buffer = u''
+        self._pos = 0
+        super(JSONResults, self).__init__(f)
+
+    def _fill(self):
+        data = self.f.read(self.chunk_size)
+        self._buffer = self._buffer[self._pos:] + \
+            self._decoder.decode(data, not data)
+        self._pos = 0
+        return bool(data)
+
+    def _peek(self):
+        """Skip whitespace and return the next character."""
+        while True:
+            self._pos = self.whitespace.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of SPARQL JSON results')
+
+    def _expect(self, chars):
+        char = self._peek()
+        if char not in chars:
+            raise ValueError('Expected one of %r in SPARQL JSON results, got %r'
+                             % (chars, char))
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """Decode the next complete JSON value."""
+        while True:
+            self._peek()
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except simplejson.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number running up to the end of the buffer may continue in
+            # the next chunk.
+            if end == len(self._buffer) and \
+               isinstance(value, (int, long, float)) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _members(self):
+        """Generate the keys of the object being parsed, leaving each value to
+        be consumed by the caller."""
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def parse(self):
+        for key in self._members():
+            if key == 'results':
+                for results_key in self._members():
+                    if results_key != 'bindings':
+                        self._value()
+                        continue
+                    self._expect('[')
+                    if self._peek() == ']':
+                        self._pos += 1
+                        continue
+                    while True:
+                        yield self._value()
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                value = self._value()
+                if key == 'head':
+                    self.vars = value.get('vars', [])
+                    self.link = value.get('link', [])
+                elif key == 'boolean':
+                    self.boolean = value
+
+class XMLResults(SPARQLResults):
+    """Incrementally parses an application/sparql-results+xml document.
+
+    Bindings are yielded in the same shape as :class:`JSONResults`, and
+    each <result> element is freed once it has been read, so memory use
+    doesn't grow with the size of the result set."""
+
+    namespace = '{http://www.w3.org/2005/sparql-results#}'
+
+    term_types = {
+        namespace + 'uri': 'uri',
+        namespace + 'literal': 'literal',
+        namespace + 'bnode': 'bnode',
+    }
+
+    def make_term(self, element):
+        term = {'type': self.term_types[element.tag],
+                'value': unicode(element.text or '')}
+        language = element.get('{http://www.w3.org/XML/1998/namespace}lang')
+        if language is not None:
+            term['xml:lang'] = language
+        datatype = element.get('datatype')
+        if datatype is not None:
+            term['datatype'] = datatype
+        return term
+
+    def parse(self):
+        ns = self.namespace
+        for event, element in etree.iterparse(self.f, events=('end',)):
+            if element.tag == ns + 'result':
+                binding = {}
+                for child in element.iterchildren(ns + 'binding'):
+                    binding[child.get('name')] = self.make_term(child[0])
+                yield binding
+                # Drop this result, and anything before it, from the tree.
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+            elif element.tag == ns + 'variable':
+                self.vars.append(element.get('name'))
+            elif element.tag == ns + 'link':
+                self.link.append(element.get('href'))
+            elif element.tag == ns + 'boolean':
+                self.boolean = element.text.strip() == 'true'
+
+class TSVResults(SPARQLResults):
+    """Parses a text/tab-separated-values SPARQL result line by line.
+
+    Bindings are yielded in the same shape as :class:`JSONResults`; terms
+    are written in N-Triples syntax (with Turtle's abbreviated numbers and
+    booleans), so nothing is lost compared to JSON or XML."""
+
+    literal_re = re.compile(r'^"((?:[^"\\]|\\.)*)"'
+                            r'(?:@([a-zA-Z]+(?:-[a-zA-Z0-9]+)*)|\^\^<([^>]*)>)?$')
+
+    abbreviated_re = re.compile(
+        r'^(?:(?P<integer>[+-]?\d+)|(?P<decimal>[+-]?\d*\.\d+)|'
+        r'(?P<double>[+-]?(?:\d+\.\d*|\.?\d+)[eE][+-]?\d+)|'
+        r'(?P<boolean>true|false))$')
+
+    def make_term(self, field):
+        first = field[0]
+        if first == '<':
+            return {'type': 'uri', 'value': nt_unescape(field[1:-1])}
+        elif first == '"':
+            match = self.literal_re.match(field)
+            if match is None:
+                raise ValueError('Bad literal in SPARQL TSV results: %r' % field)
+            term = {'type': 'literal', 'value': nt_unescape(match.group(1))}
+            if match.group(2):
+                term['xml:lang'] = match.group(2)
+            elif match.group(3):
+                term['datatype'] = nt_unescape(match.group(3))
+            return term
+        elif field.startswith('_:'):
+            return {'type': 'bnode', 'value': field[2:].decode('utf-8')}
+        match = self.abbreviated_re.match(field)
+        if match is None:
+            raise ValueError('Bad term in SPARQL TSV results: %r' % field)
+        return {'type': 'literal', 'value': unicode(field),
+                'datatype': XSD(match.lastgroup)}
+
+    def parse(self):
+        lines = iter(self.f)
+        header = next(lines, '').rstrip('\r\n')
+        self.vars = [var.lstrip('?$').decode('utf-8')
+                     for var in header.split('\t') if var]
+        make_term = self.make_term
+        for line in lines:
+            line = line.rstrip('\r\n')
+            binding = {}
+            for var, field in zip(self.vars, line.split('\t')):
+                if field:
+                    binding[var] = make_term(field)
+            yield binding
+
+class CSVResults(SPARQLResults):
+    """Parses a text/csv SPARQL result row by row.
+
+    CSV results only carry the lexical form of each value, so the bindings
+    are a best guess in the shape of :class:`JSONResults`: values starting
+    with _: are blank nodes, values that look like an IRI in a registered
+    URI scheme are IRIs, and everything else is a plain literal. Unbound
+    variables can't be told apart from empty strings and are left out."""
+
+    def make_term(self, field):
+        field = field.decode('utf-8')
+        if field.startswith('_:'):
+            return {'type': 'bnode', 'value': field[2:]}
+        scheme, colon, rest = field.partition(':')
+        if colon and scheme.lower() in schemes and not any(
+            c.isspace() for c in field):
+            return {'type': 'uri', 'value': field}
+        return {'type': 'literal', 'value': field}
+
+    def parse(self):
+        rows = csv.reader(iter(self.f))
+        self.vars = [var.decode('utf-8') for var in next(rows, [])]
+        make_term = self.make_term
+        for row in rows:
+            binding = {}
+            for var, field in zip(self.vars, row):
+                if field:
+                    binding[var] = make_term(field)
+            yield binding
+
+xsd_datetime_re = re.compile(r'^(-?\d{4,}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?)'
+                             r'(Z|[+-]\d\d:\d\d)?$')
+
+def xsd_datetime64(lexical):
+    """Convert the lexical form of an xsd:dateTime to a UTC numpy.datetime64.
+    Times without a timezone are taken to be in UTC."""
+    match = xsd_datetime_re.match(lexical.strip())
+    if not match:
+        raise ValueError('Not an xsd:dateTime: %r' % lexical)
+    moment = numpy.datetime64(match.group(1), 'us')
+    zone = match.group(2)
+    if zone and zone != 'Z':
+        offset = int(zone[1:3]) * 60 + int(zone[4:6])
+        moment -= numpy.timedelta64(offset if zone[0] == '+' else -offset, 'm')
+    return moment
+
+class Column(object):
+    """The values of one variable across a columnar result set.
+
+    codes is an int32 array with one entry per row, indexing into
+    dictionary, the list of distinct terms bound to the variable, or -1
+    where the variable is unbound. When every bound value has a numeric or
+    date datatype, values also holds them as a typed array:
+
+    * xsd:integer and its subtypes: int64, or float64 with NaN for unbound
+      rows if there are any (or any value is too big for int64)
+    * xsd:double, xsd:float and xsd:decimal: float64, NaN for unbound rows
+    * xsd:dateTime: datetime64[us] in UTC, NaT for unbound rows
+
+    Otherwise, or if any value isn't a valid literal of its datatype, values
+    is None."""
+
+    integer_datatypes = frozenset(XSD(name) for name in (
+        'integer', 'int', 'long', 'short', 'byte', 'nonNegativeInteger',
+        'nonPositiveInteger', 'negativeInteger', 'positiveInteger',
+        'unsignedLong', 'unsignedInt', 'unsignedShort', 'unsignedByte'))
+
+    float_datatypes = frozenset(XSD(name) for name in
+                                ('double', 'float', 'decimal'))
+
+    datetime_datatypes = frozenset([XSD('dateTime')])
+
+    def __init__(self, name, codes, dictionary):
+        self.name = name
+        self.codes = codes
+        self.dictionary = dictionary
+        self.values = self.typed_values()
+
+    def __len__(self):
+        return len(self.codes)
+
+    def typed_values(self):
+        datatypes = set(getattr(term, 'datatype', False)
+                        for term in self.dictionary)
+        if not datatypes:
+            return None
+        try:
+            lookup = self.lookup(datatypes)
+        except ValueError:
+            log.warning('Malformed literal in column %s, leaving it untyped',
+                        self.name)
+            return None
+        if lookup is None:
+            return None
+        # Unbound rows are coded -1, which picks the trailing missing value.
+        return lookup[self.codes]
+
+    def lookup(self, datatypes):
+        """The typed value of each term in dictionary, then the missing
+        value, or None if datatypes have no typed array."""
+        missing = (self.codes == -1).any()
+        if datatypes <= self.integer_datatypes:
+            lexicals = [int(term.value) for term in self.dictionary]
+            if not missing:
+                try:
+                    return numpy.array(lexicals, dtype=numpy.int64)
+                except OverflowError:
+                    pass
+            return numpy.array(lexicals + [numpy.nan], dtype=numpy.float64)
+        elif datatypes <= self.integer_datatypes | self.float_datatypes:
+            return numpy.array([float(term.value) for term in self.dictionary]
+                               + [numpy.nan], dtype=numpy.float64)
+        elif datatypes <= self.datetime_datatypes:
+            return numpy.array([xsd_datetime64(term.value) for term in
+                                self.dictionary] + [numpy.datetime64('NaT')],
+                               dtype='datetime64[us]')
+        return None
+
+class ColumnarResults(OrderedDict):
+    """The results of a SPARQL SELECT query as one :class:`Column` per
+    variable, for vectorized analysis with numpy.
+
+    Bindings are dictionary-encoded as they stream in, so each distinct
+    value is decoded to a term only once.
+
+    :param results: A :class:`SPARQLResults` to read."""
+
+    def __init__(self, results):
+        if numpy is None:
+            raise ImportError('Columnar SPARQL results require numpy')
+        super(ColumnarResults, self).__init__()
+        self.vars = results.vars
+        decoder = TermDecoder(self.vars)
+        codes = [array.array('i') for var in self.vars]
+        dictionaries = [{} for var in self.vars]
+        for binding in results:
+            for var, var_codes, dictionary in zip(self.vars, codes,
+                                                  dictionaries):
+                value = binding.get(var)
+                if value is None:
+                    var_codes.append(-1)
+                    continue
+                key = (value['type'], value['value'], value.get('xml:lang'),
+                       value.get('datatype'))
+                code = dictionary.get(key)
+                if code is None:
+                    code = dictionary[key] = len(dictionary)
+                var_codes.append(code)
+        for var, var_codes, dictionary in zip(self.vars, codes, dictionaries):
+            terms = [None] * len(dictionary)
+            for (type, value, language, datatype), code in \
+                dictionary.iteritems():
+                terms[code] = decoder.term({'type': type, 'value': value,
+                                            'xml:lang': language,
+                                            'datatype': datatype})
+            self[var] = Column(var, numpy.frombuffer(var_codes, numpy.int32),
+                               terms)
+        self.row_count = len(codes[0]) if codes else 0
+
+def statement_nt(statement):
+    """Serialize a Triple or Quad as a line of N-Triples or N-Quads."""
+    line = ' '.join(term.toNT() for term in statement) + ' .\n'
+    if isinstance(line, unicode):
+        line = line.encode('utf-8')
+    return line
+
+def serialize_chunks(statements, chunk_size, quads=True):
+    """Generate strings of about chunk_size bytes of N-Quads (or N-Triples,
+    if quads is false, dropping the graph of any quads) from an iterable of
+    Triple and Quad."""
+    lines = []
+    size = 0
+    for statement in statements:
+        if not quads and len(statement) == 4:
+            statement = statement[:3]
+        line = statement_nt(statement)
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield ''.join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield ''.join(lines)
+
+class _CallbackSink(object):
+    """Adapts a callable to the add method parsers feed statements to."""
+
+    def __init__(self, callback):
+        self.add = callback
+
+def gzip_chunks(chunks, level=6):
+    """Compress an iterable of strings, or a string, into gzip format,
+    yielding the compressed data as it is produced."""
+    if isinstance(chunks, basestring):
+        chunks = [chunks]
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def blazegraph_service_url(query_url):
+    """Work out the root of the Blazegraph REST API from a SPARQL endpoint,
+    eg. http://localhost:9999/bigdata from
+    http://localhost:9999/bigdata/namespace/kb/sparql."""
+    if '/namespace/' in query_url:
+        return query_url.split('/namespace/', 1)[0]
+    url = query_url.rstrip('/')
+    if url.endswith('/sparql'):
+        url = url[:-len('/sparql')]
+    return url
+
+def encode_term(term):
+    """Encode an RDF term in N-Triples syntax, as Blazegraph expects for the
+    s, p, o and c parameters of its access path operations. Plain strings
+    are taken to be IRIs."""
+    if not hasattr(term, 'toNT'):
+        term = NamedNode(term)
+    encoded = term.toNT()
+    if isinstance(encoded, unicode):
+        encoded = encoded.encode('utf-8')
+    return encoded
+
+def mutation_count(content):
+    """Read the number of statements modified from a Blazegraph mutation
+    response, such as <data modified="5" milliseconds="12"/>."""
+    return int(etree.fromstring(content).get('modified'))
+
+def blazegraph_namespace(query_url):
+    """The name of the Blazegraph namespace a SPARQL endpoint queries, or the
+    endpoint itself if it isn't a namespace's."""
+    if '/namespace/' in query_url:
+        return urllib.unquote(query_url.split('/namespace/', 1)[1]
+                              .split('/', 1)[0])
+    return query_url
+
+sparql_token_re = re.compile(r'("""(?:[^"\\]|\\.|"(?!""))*"""|'
+                             r"'''(?:[^'\\]|\\.|'(?!''))*'''|"
+                             r'"(?:[^"\\\n]|\\.)*"|'
+                             r"'(?:[^'\\\n]|\\.)*'|"
+                             r'<[^<>"{}|^`\\\s]*>)|(?:\s|#[^\n]*)+')
+
+def normalize_query(sparql):
+    """Collapse the whitespace and drop the comments in a SPARQL query,
+    leaving its strings and IRIs alone, so that queries differing only in
+    layout compare equal."""
+    def replace(match):
+        return match.group(1) or ' '
+    return sparql_token_re.sub(replace, sparql).strip()
+
+class ResultCache(object):
+    """A thread-safe, least recently used cache of SPARQL query responses,
+    for :meth:`SPARQLServer.query`.
+
+    Entries expire ttl seconds after they were fetched, or never if ttl is
+    None; the least recently used are evicted to keep to max_entries
+    entries and max_bytes of response content. Updates sent through a
+    server using the cache invalidate the entries of the namespace they
+    changed, or every entry if invalidate is 'all'. Permanent entries, for
+    queries of a commit point that can't change (see
+    :meth:`SPARQLServer.at`), never expire and aren't invalidated. A cache
+    may be shared by several servers.
+
+    The hits, misses, evictions and expirations so far are kept as
+    attributes of those names."""
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024, ttl=300,
+                 invalidate='namespace'):
+        if invalidate not in ('namespace', 'all'):
+            raise ValueError("invalidate must be 'namespace' or 'all'")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.invalidate_all = invalidate == 'all'
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def _remove(self, key):
+        namespace, expires, size, value, permanent = self.entries.pop(key)
+        self.bytes -= size
+
+    def get(self, key):
+        """The value cached for key, or None."""
+        with self._lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[1] is not None and \
+               entry[1] <= time.time():
+                self.bytes -= entry[2]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[3]
+
+    def put(self, key, value, size, namespace=None, permanent=False):
+        """Cache value, which takes size bytes, for key."""
+        if size > self.max_bytes:
+            return
+        expires = time.time() + self.ttl \
+            if self.ttl is not None and not permanent else None
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (namespace, expires, size, value, permanent)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or \
+                  self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, namespace=None):
+        """Drop the entries for namespace, or every entry if namespace is
+        None or the cache invalidates all entries on any update, except
+        permanent ones."""
+        everything = namespace is None or self.invalidate_all
+        with self._lock:
+            for key in [key for key, entry in self.entries.iteritems()
+                        if not entry[4] and (everything or
+                                             entry[0] == namespace)]:
+                self._remove(key)
+
+    def clear(self):
+        """Drop every entry, permanent or not."""
+        with self._lock:
+            self.entries.clear()
+            self.bytes = 0
+
+sparql_prologue_re = re.compile(
+    r'^((?:(?:PREFIX\s+[^\s:]*:\s*<[^>]*>|BASE\s*<[^>]*>)\s*)*)(.*)$',
+    re.I | re.S)
+sparql_select_re = re.compile(r'^SELECT\s+(?:DISTINCT\s+|REDUCED\s+)?'
+                              r'(.*?)\s*((?:FROM\s+(?:NAMED\s+)?<[^>]*>\s*)*)'
+                              r'(?:WHERE\s*)?\{', re.I | re.S)
+sparql_modifiers_re = re.compile(r'\}\s*(?:ORDER\s+BY\s+([^{}]*?))?\s*'
+                                 r'((?:(?:LIMIT|OFFSET)\s+\d+\s*)*)$',
+                                 re.I | re.S)
+sparql_parens_re = re.compile(r'\(([^()]*)\)')
+sparql_as_re = re.compile(r'\bAS\s+([?$]\w+)', re.I)
+sparql_var_re = re.compile(r'[?$](\w+)')
+
+def select_vars(projection):
+    """The names of the variables a SELECT clause projects, or None for *."""
+    if projection.strip() == '*':
+        return None
+    while True:
+        def replace(match):
+            assignment = sparql_as_re.search(match.group(1))
+            return ' %s ' % assignment.group(1) if assignment else ' '
+        projection, replaced = sparql_parens_re.subn(replace, projection)
+        if not replaced:
+            return sparql_var_re.findall(projection)
+
+class PagedQuery(object):
+    """The bindings of a SELECT query, fetched a page at a time so that
+    neither the server nor the client has to produce or hold them all at
+    once. From :meth:`SPARQLServer.query_pages`.
+
+    The query is wrapped as a subquery of one that orders its results and
+    takes page_size of them at a time, by OFFSET or (given a keyset
+    variable) by the value of the key. While one page is being consumed,
+    the next is fetched on a background thread. Iteration stops after the
+    first page with fewer than page_size results.
+
+    Keyset pagination asks for the results whose key comes after the last
+    one seen, which the server can find without generating and skipping
+    every earlier result as OFFSET does; the cost of each page stays the
+    same however far into the results it is. The key must be an IRI or
+    literal, bound in every result and unique among them; keys are ordered
+    by their string values.
+
+    An ORDER BY at the end of the query is moved out to the paging query,
+    followed by the variables the query selects to break ties, so it may
+    only use those variables. A query with its own LIMIT or OFFSET can't be
+    paginated.
+
+    Bindings have the shape of those from :meth:`SPARQLServer.query`, or
+    are rows of terms if decode is true (see :class:`TermDecoder`)."""
+
+    def __init__(self, server, sparql, page_size=10000, order_by=None,
+                 keyset=None, decode=False, prefetch=True, **kwargs):
+        self.server = server
+        self.page_size = page_size
+        self.keyset = keyset.lstrip('?$') if keyset else None
+        self.decode = decode
+        self.prefetch = prefetch
+        self.kwargs = kwargs
+        self.vars = None
+        self.pages = 0
+        self.prologue, query = sparql_prologue_re.match(
+            normalize_query(sparql)).groups()
+        select = sparql_select_re.match(query)
+        if select is None:
+            raise ValueError('Only SELECT queries can be paginated')
+        self.dataset = select.group(2)
+        self.subquery = query[:select.start(2)] + query[select.end(2):]
+        modifiers = sparql_modifiers_re.search(self.subquery)
+        if modifiers and modifiers.group(2):
+            raise ValueError('Queries with a LIMIT or OFFSET can\'t be '
+                             'paginated')
+        query_order = modifiers.group(1) if modifiers else None
+        if query_order:
+            if self.keyset or order_by:
+                raise ValueError('The query is already ordered by %s' %
+                                 query_order)
+            self.subquery = self.subquery[:modifiers.start() + 1]
+            order_by = query_order
+            variables = select_vars(select.group(1))
+            if variables:
+                order_by += ' ' + ' '.join('?' + var for var in variables)
+        if self.keyset:
+            self.order_by = 'STR(?%s)' % self.keyset
+        elif order_by:
+            self.order_by = order_by if isinstance(order_by, basestring) \
+                else ' '.join('?' + var.lstrip('?$') for var in order_by)
+        else:
+            self.order_by = None
+            self.vars = select_vars(select.group(1))
+
+    def page_query(self, offset=0, after=None):
+        """The SPARQL for a page of results."""
+        condition = ''
+        if after is not None:
+            condition = ' FILTER(STR(?%s) > %s)' % (
+                self.keyset, Literal(after).toNT().decode('utf-8'))
+        order_by = self.order_by or ' '.join('?' + var for var in self.vars)
+        return '%sSELECT * %sWHERE { { %s }%s }%s LIMIT %d%s' % (
+            self.prologue, self.dataset, self.subquery, condition,
+            ' ORDER BY ' + order_by if order_by else '', self.page_size,
+            ' OFFSET %d' % offset if offset else '')
+
+    def fetch(self, offset=0, after=None):
+        """One page of results, as a list of bindings."""
+        results = self.server.query(self.page_query(offset, after),
+                                    **self.kwargs)
+        if self.vars is None:
+            self.vars = results['head']['vars']
+        return results['results']['bindings']
+
+    def iter_pages(self):
+        """Iterate over the pages of results, as lists of bindings."""
+        if self.order_by is None and self.vars is None:
+            # SELECT *: find out which variables to order by.
+            self.vars = self.server.query(
+                '%sSELECT * %sWHERE { { %s } } LIMIT 0' % (
+                    self.prologue, self.dataset, self.subquery),
+                **self.kwargs)['head']['vars']
+        workers = WorkerPool(1) if self.prefetch else None
+        try:
+            offset = 0
+            page = self.fetch()
+            while True:
+                self.pages += 1
+                offset += len(page)
+                last = len(page) < self.page_size
+                if not last:
+                    if self.keyset:
+                        offset, after = 0, page[-1][self.keyset]['value']
+                    else:
+                        after = None
+                    if workers is not None:
+                        following = workers.submit(self.fetch, offset, after)
+                    else:
+                        following = None
+                if self.decode:
+                    decoder = TermDecoder(self.vars)
+                    yield [decoder.row(binding) for binding in page]
+                else:
+                    yield page
+                if last:
+                    return
+                page = following.result() if following is not None \
+                    else self.fetch(offset, after)
+                if not page:
+                    return
+        finally:
+            if workers is not None:
+                workers.shutdown()
+
+    def __iter__(self):
+        for page in self.iter_pages():
+            for binding in page:
+                yield binding
+
+class PreparedQuery(object):
+    """A SPARQL query template whose variables are bound to values on each
+    execution by Blazegraph's $var request parameters, from
+    :meth:`SPARQLServer.prepare`.
+
+    As the query text is the same every time, there is no escaping of
+    values into it, and the server can reuse what it learnt from parsing it
+    before. Values are encoded by :func:`encode_term`, so give literals as
+    :class:`pymantic.primitives.Literal`; strings are taken as IRIs.
+
+    The variables of each template are parsed once and kept in templates,
+    shared by all prepared queries, which holds the max_templates most
+    recently prepared."""
+
+    templates = OrderedDict()
+    max_templates = 1000
+    _templates_lock = threading.Lock()
+
+    def __init__(self, server, sparql):
+        self.server = server
+        self.sparql = sparql
+        self.variables = self.template_variables(sparql)
+
+    @classmethod
+    def template_variables(cls, sparql):
+        """The names of the variables in the query text sparql."""
+        with cls._templates_lock:
+            variables = cls.templates.pop(sparql, None)
+            if variables is not None:
+                cls.templates[sparql] = variables
+                return variables
+        variables = frozenset(sparql_var_re.findall(
+            sparql_token_re.sub(' ', sparql)))
+        with cls._templates_lock:
+            cls.templates[sparql] = variables
+            while len(cls.templates) > cls.max_templates:
+                cls.templates.popitem(last=False)
+        return variables
+
+    def bind(self, bindings):
+        """The server to run the query against with bindings, a dictionary
+        from variable names to values."""
+        params = {}
+        for name, value in bindings.iteritems():
+            name = name.lstrip('?$')
+            if name not in self.variables:
+                raise ValueError('%s is not a variable of the query' % name)
+            params['$' + name] = encode_term(value)
+        return self.server.with_params(**params)
+
+    def query(self, bindings=None, **kwargs):
+        """Runs the query as :meth:`SPARQLServer.query`."""
+        return self.bind(bindings or {}).query(self.sparql, **kwargs)
+
+    def query_iter(self, bindings=None, **kwargs):
+        """Runs the query as :meth:`SPARQLServer.query_iter`."""
+        return self.bind(bindings or {}).query_iter(self.sparql, **kwargs)
+
+    def query_many(self, bindings, workers=10, **kwargs):
+        """Runs the query for each of a list of bindings, up to workers at
+        once over the connection pool.
+
+        :returns: A list of the results, in the order of bindings."""
+        pool = WorkerPool(workers)
+        try:
+            return pool.map(lambda each: self.query(each, **kwargs), bindings)
+        finally:
+            pool.shutdown()
+
+class RetryPolicy(object):
+    """When and how to retry requests that fail for reasons likely to pass,
+    such as a 503 while the store is paused for garbage collection or a
+    connection reset.
+
+    A request is tried up to max_attempts times, sleeping between attempts
+    for backoff seconds, doubling each time up to max_backoff, less a random
+    fraction (up to jitter) of that so that many clients don't all retry at
+    once. Responses with a status in retry_statuses and the
+    connection_errors are retried; anything else is returned or raised
+    straight away. Requests that aren't idempotent, such as most updates,
+    are never retried.
+
+    A request with a deadline isn't retried once the wait before the next
+    attempt would take it past the deadline; it fails with
+    :class:`DeadlineExceededException` instead.
+
+    Every retry is counted in retries, by status code or exception name,
+    and requests that failed after their last attempt in exhausted."""
+
+    connection_errors = (httplib.HTTPException, socket.error)
+
+    def __init__(self, max_attempts=3, backoff=0.5, max_backoff=30,
+                 jitter=0.5, retry_statuses=(500, 502, 503, 504)):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retries = Counter()
+        self.exhausted = 0
+        self._lock = threading.Lock()
+
+    def delay(self, attempt):
+        """Seconds to wait after the given failed attempt, counting from 1."""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def _retry(self, attempt, reason, expires):
+        delay = self.delay(attempt)
+        with self._lock:
+            if attempt >= self.max_attempts:
+                self.exhausted += 1
+                return False
+            if expires is not None and time.time() + delay >= expires:
+                self.exhausted += 1
+                raise DeadlineExceededException(
+                    'Deadline would pass before retrying after %s' % reason)
+            self.retries[reason] += 1
+        log.warning('Retrying request after %s (attempt %d of %d)', reason,
+                    attempt, self.max_attempts)
+        time.sleep(delay)
+        return True
+
+    def call(self, send, idempotent=True, expires=None):
+        """Make a request, retrying it as needed.
+
+        :param send: Makes one attempt at the request, returning a
+            :class:`PooledResponse` or a (response, content) pair.
+        :param idempotent: Whether the request may safely be repeated.
+        :param expires: The time of the request's deadline, if it has one.
+        :returns: What send last returned."""
+        attempt = 1
+        while True:
+            try:
+                result = send()
+            except self.connection_errors as e:
+                if not idempotent or not self._retry(attempt,
+                                                     type(e).__name__,
+                                                     expires):
+                    raise
+            else:
+                response = result[0] if isinstance(result, tuple) else result
+                if not idempotent or \
+                   response.status not in self.retry_statuses:
+                    return result
+                try:
+                    retry = self._retry(attempt, str(response.status), expires)
+                except DeadlineExceededException:
+                    if isinstance(result, PooledResponse):
+                        result.close()
+                    raise
+                if not retry:
+                    return result
+                if isinstance(result, PooledResponse):
+                    result.close()
+            attempt += 1
+
 class _SelectOrUpdate(object):
     """A server that can run SPARQL queries."""
 
@@ -32,7 +1680,7 @@ class _SelectOrUpdate(object):
         self.default_graphs=default_graph
         self.named_graphs=named_graph
         self.headers = dict()
-        self.params = dict()
+        self.params = dict(server.params)
 
 # abstract methods, see Select for the idea
     def default_graph_uri(self):
@@ -50,9 +1698,8 @@ class _SelectOrUpdate(object):
     def postQueries(self):
         pass
 
-    def execute(self):
-        http = httplib2.Http()
-
+    def build_request(self):
+        """Work out the (uri, method, body) of the HTTP request to send."""
         log.debug("Querying: %s with: %r", self.server.query_url, self.sparql)
 
         sparql = self.sparql.encode('utf-8')
@@ -83,11 +1730,31 @@ class _SelectOrUpdate(object):
         uri = self.server.query_url
         if uri_params:
             uri = uri + "?" + uri_params
-        response, content = http.request(uri=uri, method=method, headers=self.headers, body=body)
+        return uri, method, body
+
+    def deadline_expires(self):
+        """The time the request's deadline passes, shared by every attempt
+        at it, or None."""
+        return None
+
+    def start_deadline(self, expires):
+        """A started :class:`Deadline` for one attempt at the request, or
+        None."""
+        return None
+
+    def idempotent(self):
+        pass
+
+    def execute(self):
+        uri, method, body = self.build_request()
+        expires = self.deadline_expires()
+        response, content = self.server.retry.call(
+            lambda: self.server.pool.request(uri=uri, method=method, headers=self.headers, body=body, deadline=self.start_deadline(expires)),
+            self.idempotent(), expires)
         if response['status'] == '204':
             return True
         if response['status'] != '200':
-            raise SPARQLQueryException('%s: %s\nQuery: %s' % (response, content, self.sparql))
+            raise SPARQLQueryException('%s: %s\nQuery: %s' % (response, content, self.sparql), response.status)
         return response, content
 
 class _Select(_SelectOrUpdate):
@@ -102,10 +1769,29 @@ class _Select(_SelectOrUpdate):
         'text/turtle',
     ]
 
+    streaming_results = [
+        ('application/sparql-results+json', JSONResults),
+        ('application/sparql-results+xml', XMLResults),
+        ('text/tab-separated-values', TSVResults),
+        ('text/csv', CSVResults),
+    ]
+
     def __init__(self, server, query, timeout, output='json', *args,**kwargs):
+        self.decode = kwargs.pop('decode', False)
+        self.use_cache = kwargs.pop('cache', True)
+        analytic = kwargs.pop('analytic', False)
+        self.deadline = kwargs.pop('deadline', None)
+        self.query_id = kwargs.pop('query_id', None) or str(uuid.uuid4())
         super(_Select,self).__init__(server, query, *args,**kwargs)
+        self.params['queryId'] = self.query_id
+        if analytic:
+            self.params['analytic'] = 'true'
         if output=='xml':
             self.headers['Accept'] = ','.join(self.acceptable_xml_responses)
+        elif output=='tsv':
+            self.headers['Accept'] = 'text/tab-separated-values'
+        elif output=='csv':
+            self.headers['Accept'] = 'text/csv'
         else:
             self.headers['Accept'] = ','.join(self.acceptable_json_responses)
 
@@ -127,8 +1813,41 @@ class _Select(_SelectOrUpdate):
     def postQueries(self):
         return self.server.post_queries
 
+    def idempotent(self):
+        return True
+
+    def deadline_expires(self):
+        if self.deadline is None:
+            return None
+        return time.time() + self.deadline
+
+    def start_deadline(self, expires):
+        if expires is None:
+            return None
+        return Deadline(self.deadline,
+                        lambda: self.server.cancel(self.query_id)).start(expires)
+
+    def cache_key(self):
+        params = sorted((name, value) for name, value in self.params.items()
+                        if name != 'queryId')
+        return (self.server.query_url, normalize_query(self.sparql),
+                repr(self.default_graphs), repr(self.named_graphs),
+                self.headers['Accept'], tuple(params))
+
     def execute(self):
-        response, content = super(_Select,self).execute()
+        cache = self.server.cache if self.use_cache else None
+        cached = None
+        if cache is not None:
+            key = self.cache_key()
+            cached = cache.get(key)
+        if cached is not None:
+            response, content = cached
+        else:
+            response, content = super(_Select,self).execute()
+            if cache is not None:
+                cache.put(key, (response, content), len(content),
+                          self.server.namespace,
+                          self.server.timestamp is not None)
         format = None
         if response['content-type'].startswith('application/rdf+xml'):
             format = 'xml'
@@ -145,11 +1864,51 @@ class _Select(_SelectOrUpdate):
             return simplejson.loads(unicode(content, "utf-8"))
         elif response['content-type'].startswith('application/sparql-results+xml'):
             return objectify.parse(StringIO(content))
-        else:
-            raise UnknownSPARQLReturnTypeException('Got content of type: %s' %
-                                                   response['content-type'])
+        for mime_type, results_class in self.streaming_results:
+            if response['content-type'].startswith(mime_type):
+                # TSV and CSV results take the shape of JSON ones.
+                results = results_class(StringIO(content))
+                bindings = list(results)
+                return {'head': {'vars': results.vars},
+                        'results': {'bindings': bindings}}
+        raise UnknownSPARQLReturnTypeException('Got content of type: %s' %
+                                               response['content-type'])
+
+    def stream(self):
+        """Send the query and return a :class:`SPARQLResults` reading the
+        response as it arrives."""
+        uri, method, body = self.build_request()
+        expires = self.deadline_expires()
+        response = self.server.retry.call(lambda: self.server.pool.urlopen(
+            uri, method, body, self.headers, self.start_deadline(expires)),
+            True, expires)
+        if response.status != 200:
+            content = response.read()
+            response.close()
+            raise SPARQLQueryException('%s: %s\nQuery: %s' %
+                                       (response.headers, content, self.sparql),
+                                       response.status)
+        content_type = response.headers.get('content-type', '')
+        for mime_type, results_class in self.streaming_results:
+            if content_type.startswith(mime_type):
+                try:
+                    results = results_class(response)
+                    if self.decode:
+                        results.decoder = TermDecoder(results.vars)
+                except Exception:
+                    response.close()
+                    raise
+                results.query_id = self.query_id
+                return results
+        response.close()
+        raise UnknownSPARQLReturnTypeException('Got content of type: %s' %
+                                               content_type)
 
 class _Update(_SelectOrUpdate):
+    def __init__(self, server, sparql, idempotent=False, *args, **kwargs):
+        super(_Update, self).__init__(server, sparql, *args, **kwargs)
+        self.is_idempotent = idempotent
+
     def default_graph_uri(self):
         return 'using-graph-uri'
 
@@ -165,13 +1924,72 @@ class _Update(_SelectOrUpdate):
     def postQueries(self):
         return True
 
+    def idempotent(self):
+        return self.is_idempotent
+
 class SPARQLServer(object):
-    """A server that can run SPARQL queries."""
+    """A server that can run SPARQL queries.
+
+    Requests are sent over a :class:`ConnectionPool` of keep-alive
+    connections; pass pool to share one pool between several servers.
+    service_url is the root of the Blazegraph REST API (eg.
+    http://localhost:9999/bigdata), worked out from query_url if not given.
+    Pass a :class:`ResultCache` as cache to cache the responses to
+    :meth:`query`, and a :class:`RetryPolicy` as retry to change how failed
+    queries and updates are retried. compress_uploads is the gzip level
+    (1 to 9) to compress RDF uploaded by :meth:`insert` and the like with,
+    or None to send it uncompressed; the server must accept gzip request
+    bodies."""
 
-    def __init__(self, query_url, post_queries=False, post_directly=False):
+    def __init__(self, query_url, post_queries=False, post_directly=False,
+                 pool=None, service_url=None, cache=None, retry=None,
+                 compress_uploads=None):
         self.query_url = query_url
         self.post_queries = post_queries
         self.post_directly = post_directly
+        self.pool = pool if pool is not None else ConnectionPool()
+        self.service_url = service_url or blazegraph_service_url(query_url)
+        self.namespace = blazegraph_namespace(query_url)
+        self.cache = cache
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.compress_uploads = compress_uploads
+        self.timestamp = None
+        self.params = {}
+
+    def with_params(self, **params):
+        """A copy of this server, sharing its connection pool, that adds params
+        to each request it sends to query_url."""
+        view = copy.copy(self)
+        view.params = dict(self.params, **params)
+        return view
+
+    def at(self, timestamp, cache=None):
+        """A view of the store as of a commit point, for reads only.
+
+        Every query through the view reads the store as it was at the last
+        commit at or before timestamp, however it has changed since; so they
+        don't wait on or hold up writers, and their results never change.
+        Query results it caches never expire and aren't invalidated by
+        updates (pin timestamp to a commit point in the past, or later
+        commits could still change them).
+
+        :param timestamp: The commit time, as milliseconds since the epoch
+            or a datetime (in UTC if naive).
+        :param cache: A :class:`ResultCache` for the view's query results, if
+            not the server's own.
+        :returns: A :class:`SPARQLServer` sharing this one's connection
+            pool."""
+        if isinstance(timestamp, datetime.datetime):
+            if timestamp.tzinfo is not None:
+                timestamp = timestamp.astimezone(pytz.utc).replace(tzinfo=None)
+            delta = timestamp - datetime.datetime(1970, 1, 1)
+            timestamp = (delta.days * 86400 + delta.seconds) * 1000 + \
+                delta.microseconds // 1000
+        view = self.with_params(timestamp=timestamp)
+        view.timestamp = timestamp
+        if cache is not None:
+            view.cache = cache
+        return view
 
     acceptable_sparql_responses = [
         'application/sparql-results+json',
@@ -186,16 +2004,715 @@ class SPARQLServer(object):
         * application/rdf+xml: an rdflib.ConjunctiveGraph
         * application/sparql-results+json: A dictionary from simplejson
         * application/sparql-results+xml: An lxml.objectify structure
+        * text/tab-separated-values and text/csv (for output='tsv' or
+          'csv'): A dictionary in the shape of the JSON one
+
+        Each query is tagged with a queryId, by which it can be cancelled
+        with :meth:`cancel`; a random one is made up unless query_id is given.
 
         :param sparql: The SPARQL to execute.
+        :param timeout: Milliseconds the server may spend running the query.
+        :param query_id: The queryId (a UUID) to tag the query with.
+        :param deadline: Seconds to wait for the response before cancelling
+            the query and abandoning the request with
+            :class:`DeadlineExceededException`. For :meth:`query_iter` this
+            covers reading all the results.
+        :param cache: Whether to use the server's :class:`ResultCache`, if it
+            has one. Only :meth:`query` is cached.
+        :param analytic: Run the query on Blazegraph's analytic query engine,
+            which keeps intermediate solutions in native memory rather than
+            on the Java heap; often faster for queries with large joins.
         :returns: The results of the query from the SPARQL store."""
         return _Select(self, sparql, timeout, *args, **kwargs).execute()
 
+    def query_iter(self, sparql, timeout=None, *args, **kwargs):
+        """Executes a SPARQL SELECT or ASK query, streaming the results.
+
+        Unlike :meth:`query` the response isn't loaded all at once: bindings
+        are parsed one at a time as they are read from the connection. The
+        bindings have the same shape for each output format: 'json', 'xml',
+        'tsv' or 'csv' (which loses datatypes; see :class:`CSVResults`).
+
+        :param sparql: The SPARQL to execute.
+        :param decode: If true, yield rows of :mod:`pymantic.primitives` terms
+            (see :class:`TermDecoder`) instead of bindings.
+        :returns: A :class:`SPARQLResults` over the bindings of the query,
+            with the queryId of the query as query_id."""
+        return _Select(self, sparql, timeout, *args, **kwargs).stream()
+
+    def query_pages(self, sparql, page_size=10000, order_by=None, keyset=None,
+                    **kwargs):
+        """Executes a SPARQL SELECT query a page of results at a time, for
+        queries with too many results to fetch at once.
+
+        :param sparql: The SPARQL to execute.
+        :param page_size: The number of results to fetch at a time.
+        :param order_by: The variables (or an ORDER BY expression) to order
+            the results by, so that pages don't overlap. By default, the
+            query's own ORDER BY if it has one, or all the variables the query
+            selects.
+        :param keyset: A variable unique in every result to page through the
+            results by, instead of OFFSET, which is faster for deep pages.
+        :param prefetch: Whether to fetch the next page while the last is
+            being consumed, by default True.
+        :param decode: If true, yield rows of :mod:`pymantic.primitives` terms
+            instead of bindings.
+        :returns: A :class:`PagedQuery` iterating over the bindings; other
+            keyword arguments are passed to :meth:`query`."""
+        return PagedQuery(self, sparql, page_size, order_by, keyset, **kwargs)
+
+    def explain(self, sparql, details=False, **kwargs):
+        """Runs a SPARQL query and returns how the server ran it, from the
+        page Blazegraph serves for the explain parameter.
+
+        :param details: Ask for more detail, including the query plan at
+            each stage of optimization.
+        :returns: A :class:`QueryPlan`. Other keyword arguments are as for
+            :meth:`query`."""
+        select = _Select(self, sparql, kwargs.pop('timeout', None), **kwargs)
+        select.params['explain'] = 'details' if details else ''
+        select.headers['Accept'] = 'text/html'
+        response, content = _SelectOrUpdate.execute(select)
+        return QueryPlan.parse(content)
+
+    def prepare(self, sparql):
+        """Prepares a query to run with different values bound to its
+        variables.
+
+        :returns: A :class:`PreparedQuery`."""
+        return PreparedQuery(self, sparql)
+
+    def query_columns(self, sparql, timeout=None, *args, **kwargs):
+        """Executes a SPARQL SELECT query and returns the results by column,
+        as numpy arrays ready for vectorized analysis. Requires numpy.
+
+        :param sparql: The SPARQL to execute.
+        :returns: A :class:`ColumnarResults` with a :class:`Column` for each
+            variable."""
+        if numpy is None:
+            raise ImportError('query_columns requires numpy')
+        with self.query_iter(sparql, timeout, *args, **kwargs) as results:
+            return ColumnarResults(results)
+
     def update(self, sparql, **kwargs):
         """Executes a SPARQL update.
 
-        :param sparql: The SPARQL Update request to execute."""
-        return _Update(self, sparql, **kwargs).execute()
+        :param sparql: The SPARQL Update request to execute.
+        :param idempotent: Whether running the update twice has the same
+            effect as running it once (eg. DELETE DATA, or CLEAR), so that it
+            may be retried like a query if it fails."""
+        try:
+            return _Update(self, sparql, **kwargs).execute()
+        finally:
+            self.invalidate_cache()
+
+    def invalidate_cache(self):
+        """Drop the cached results of queries against this server's
+        namespace, after it has been changed."""
+        if self.cache is not None:
+            self.cache.invalidate(self.namespace)
+
+    def status(self, queries=False, details=False):
+        """Reads the server's status page.
+
+        :param queries: Include the queries running on the server.
+        :param details: Include details of the queries' execution.
+        :returns: A :class:`ServerStatus`."""
+        params = {}
+        if queries or details:
+            params['showQueries'] = 'details' if details else ''
+        uri = self.service_url + '/status'
+        if params:
+            uri += '?' + urllib.urlencode(params)
+        response, content = self.retry.call(
+            lambda: self.pool.request(uri=uri, method='GET'), True)
+        if response['status'] != '200':
+            raise SPARQLQueryException('%s: %s' % (response, content),
+                                       response.status)
+        return ServerStatus.parse(content)
+
+    def poll_status(self, interval=10, count=None, **kwargs):
+        """Reads the server's status every interval seconds, count times or
+        forever, yielding each :class:`ServerStatus` together with its
+        :meth:`~ServerStatus.delta` from the one before (None the first
+        time). Takes the same arguments as :meth:`status`."""
+        previous = None
+        polled = 0
+        while count is None or polled < count:
+            if polled:
+                time.sleep(max(0, previous.time + interval - time.time()))
+            status = self.status(**kwargs)
+            yield status, status.delta(previous) if previous else None
+            previous = status
+            polled += 1
+
+    def cancel(self, query_id):
+        """Cancels a running query.
+
+        :param query_id: The queryId of the query, or a list of them."""
+        response, content = self.pool.request(
+            uri=self.access_path_url('cancelQuery', {'queryId': query_id}),
+            method='POST')
+        if response['status'] != '200':
+            raise SPARQLQueryException('%s: %s' % (response, content),
+                                       response.status)
+
+    def access_path_params(self, s=None, p=None, o=None, c=None):
+        """The request parameters selecting statements that match a pattern,
+        where None matches anything."""
+        params = {}
+        for name, term in (('s', s), ('p', p), ('o', o), ('c', c)):
+            if term is not None:
+                params[name] = encode_term(term)
+        return params
+
+    def access_path_url(self, operation, params):
+        """The URL of an access path operation, such as ESTCARD, which is
+        given as a parameter with no value."""
+        query = urllib.urlencode(dict(self.params, **params), doseq=True)
+        if operation:
+            query = operation + ('&' + query if query else '')
+        return self.query_url + ('?' + query if query else '')
+
+    def estimate_cardinality(self, s=None, p=None, o=None, c=None,
+                             exact=False):
+        """Counts the statements matching a pattern with Blazegraph's fast
+        range count (ESTCARD) access path, which reads the count off the
+        indices rather than running a query.
+
+        :param s: The subject to match, or None for any.
+        :param p: The predicate to match, or None for any.
+        :param o: The object to match, or None for any.
+        :param c: The context (named graph) to match, or None for any.
+        :param exact: Ask for an exact count rather than a fast estimate, which
+            may count deleted statements that haven't been purged yet.
+        :returns: The number of matching statements."""
+        params = self.access_path_params(s, p, o, c)
+        if exact:
+            params['exact'] = 'true'
+        uri = self.access_path_url('ESTCARD', params)
+        response, content = self.retry.call(
+            lambda: self.pool.request(uri=uri, method='GET'), True)
+        if response['status'] != '200':
+            raise SPARQLQueryException('%s: %s' % (response, content),
+                                       response.status)
+        return int(etree.fromstring(content).get('rangeCount'))
+
+    def has_statement(self, s=None, p=None, o=None, c=None,
+                      include_inferred=True):
+        """Checks whether any statement matches a pattern with Blazegraph's
+        HASSTMT access path, without going through the SPARQL parser.
+
+        :param include_inferred: Whether inferred statements count.
+        :returns: True if a matching statement exists."""
+        params = self.access_path_params(s, p, o, c)
+        params['includeInferred'] = 'true' if include_inferred else 'false'
+        uri = self.access_path_url('HASSTMT', params)
+        response, content = self.retry.call(
+            lambda: self.pool.request(uri=uri, method='GET'), True)
+        if response['status'] != '200':
+            raise SPARQLQueryException('%s: %s' % (response, content),
+                                       response.status)
+        return etree.fromstring(content).get('result') == 'true'
+
+    def has_statements(self, statements, include_inferred=True, workers=10):
+        """Checks whether each of a list of triples or quads exists, running up
+        to workers checks at once over the connection pool.
+
+        :returns: A list of booleans, in the order of statements."""
+        pool = WorkerPool(workers)
+        try:
+            return pool.map(
+                lambda statement: self.has_statement(
+                    *statement, include_inferred=include_inferred),
+                statements)
+        finally:
+            pool.shutdown()
+
+    def delete_matching(self, s=None, p=None, o=None, c=None):
+        """Deletes the statements matching a pattern with Blazegraph's DELETE
+        access path, without a SPARQL update to parse and plan. At least one
+        of s, p, o and c must be given.
+
+        :returns: The number of statements deleted."""
+        params = self.access_path_params(s, p, o, c)
+        if not params:
+            raise ValueError('A pattern to delete by is required')
+        try:
+            response, content = self.pool.request(
+                uri=self.access_path_url(None, params), method='DELETE')
+        finally:
+            self.invalidate_cache()
+        if response['status'] != '200':
+            raise SPARQLQueryException('%s: %s' % (response, content),
+                                       response.status)
+        return mutation_count(content)
+
+    def delete_matching_many(self, patterns, workers=10):
+        """Runs :meth:`delete_matching` for each of a list of patterns, up to
+        workers at a time. Each pattern is an (s, p, o) or (s, p, o, c)
+        sequence, or a dictionary of keyword arguments.
+
+        :returns: A list of the number of statements each pattern deleted."""
+        def delete(pattern):
+            if isinstance(pattern, dict):
+                return self.delete_matching(**pattern)
+            return self.delete_matching(*pattern)
+
+        pool = WorkerPool(workers)
+        try:
+            return pool.map(delete, patterns)
+        finally:
+            pool.shutdown()
+
+    def transaction(self, timestamp=None):
+        """Starts a read/write transaction.
+
+        :param timestamp: The commit time the transaction should read from,
+            by default the last commit.
+        :returns: A :class:`Transaction`."""
+        uri = self.service_url + '/tx'
+        if timestamp is not None:
+            uri += '?' + urllib.urlencode({'timestamp': timestamp})
+        response, content = self.pool.request(uri=uri, method='POST')
+        if response['status'] not in ('200', '201'):
+            raise SPARQLQueryException('%s: %s' % (response, content),
+                                       response.status)
+        return Transaction(self, transaction_descriptions(content)[0]['txId'])
+
+    def transactions(self):
+        """Lists the active transactions, described as for
+        :meth:`Transaction.status`."""
+        response, content = self.pool.request(uri=self.service_url + '/tx',
+                                              method='GET')
+        if response['status'] != '200':
+            raise SPARQLQueryException('%s: %s' % (response, content),
+                                       response.status)
+        return transaction_descriptions(content)
+
+    statement_parsers = {
+        'nquads': nquads_parser,
+        'ntriples': ntriples_parser,
+    }
+
+    def get_statements(self, s=None, p=None, o=None, c=None, format='nquads',
+                       sink=None, include_inferred=True):
+        """Fetches the statements matching a pattern with Blazegraph's GETSTMTS
+        access path. The response is parsed a line at a time as it arrives,
+        so it is never held in memory all at once.
+
+        :param format: 'nquads' or 'ntriples'.
+        :param sink: Where to put the statements: a Graph, Dataset or anything
+            else with an add method, or a callable to call with each Triple
+            or Quad. By default a new Dataset, or Graph for ntriples.
+        :param include_inferred: Whether to include inferred statements.
+        :returns: sink."""
+        params = self.access_path_params(s, p, o, c)
+        params['includeInferred'] = 'true' if include_inferred else 'false'
+        parser = self.statement_parsers[format]
+        if sink is None:
+            sink = parser._make_graph()
+        uri = self.access_path_url('GETSTMTS', params)
+        headers = {'Accept': self.rdf_content_types[format]}
+        response = self.retry.call(
+            lambda: self.pool.urlopen(uri, 'GET', headers=headers), True)
+        try:
+            if response.status != 200:
+                raise SPARQLQueryException('%s: %s' % (response.headers,
+                                                       response.read()),
+                                           response.status)
+            parser.parse_lines(response, sink if hasattr(sink, 'add') else
+                               _CallbackSink(sink))
+        finally:
+            response.close()
+        return sink
+
+    rdf_content_types = {
+        'ntriples': 'text/plain',
+        'nquads': 'text/x-nquads',
+    }
+
+    def encode_upload(self, body, headers):
+        """Compress the body of an RDF upload if compress_uploads is set.
+        Returns the body to send and adds to headers to suit."""
+        if self.compress_uploads is None:
+            return body
+        headers['Content-Encoding'] = 'gzip'
+        compressed = gzip_chunks(body, self.compress_uploads)
+        if isinstance(body, basestring):
+            return ''.join(compressed)
+        return compressed
+
+    def post_rdf(self, chunks, format='nquads', params=None):
+        """POST RDF to the store, streaming the body from an iterable of
+        strings in the given serialization format with chunked transfer
+        encoding. Returns the number of statements modified."""
+        headers = {'Content-Type': self.rdf_content_types[format]}
+        body = self.encode_upload(chunks, headers)
+        try:
+            response, content = self.pool.request(
+                uri=self.access_path_url(None, params or {}), method='POST',
+                body=body, headers=headers)
+        finally:
+            self.invalidate_cache()
+        if response['status'] != '200':
+            raise SPARQLQueryException('%s: %s' % (response, content),
+                                       response.status)
+        return mutation_count(content)
+
+    def bulk_load(self, source, progress=None, **kwargs):
+        """Loads a large file or iterable of statements in concurrent batches.
+        Keyword arguments configure the :class:`BulkLoader` used.
+
+        :returns: A :class:`LoadReport` of each batch's throughput."""
+        return BulkLoader(self, **kwargs).load(source, progress)
+
+    def insert(self, statements, format='nquads', chunk_size=65536,
+               context_uri=None):
+        """Inserts RDF statements into the store by POSTing them. They are
+        serialized as they are sent, so the whole payload is never held in
+        memory.
+
+        :param statements: A Graph, Dataset or any iterable of Triple and Quad.
+        :param format: 'nquads' or 'ntriples' (which drops the graph of any
+            quads).
+        :param chunk_size: Roughly how many bytes to send per chunk.
+        :param context_uri: The named graph to insert triples into, for a
+            store in quads mode.
+        :returns: The number of statements the store reports as modified."""
+        chunks = serialize_chunks(statements, chunk_size,
+                                  quads=(format == 'nquads'))
+        params = {'context-uri': context_uri} if context_uri else None
+        return self.post_rdf(chunks, format, params)
+
+status_pair_re = re.compile(r'([A-Za-z][\w/. -]*?)=([^,\s]*)')
+
+def status_value(value):
+    """A number from the status page if value is one, else value."""
+    if value.endswith('ms') and value[:-2].isdigit():
+        value = value[:-2]
+    for number in (int, float):
+        try:
+            return number(value)
+        except ValueError:
+            pass
+    return value
+
+class RunningQuery(namedtuple('RunningQuery', 'query_id elapsed sparql '
+                                              'details')):
+    """A query running on the server when its status was read: its queryId,
+    the milliseconds it had been running, its text, and everything else the
+    status page said about it (isCancelled, solutions, ...) by name."""
+
+    __slots__ = ()
+
+class ServerStatus(object):
+    """What the status page of a Blazegraph server said at time: its counters
+    by name (eg. 'Running query count', '/queryStartCount'), and a
+    :class:`RunningQuery` for each query running if they were asked for."""
+
+    def __init__(self, counters, queries, time):
+        self.counters = counters
+        self.queries = queries
+        self.time = time
+
+    @classmethod
+    def parse(cls, content, when=None):
+        html = etree.fromstring(content, etree.HTMLParser())
+        counters = {}
+        queries = []
+        for element in html.iter('p', 'pre', 'h2'):
+            text = element.text or ''
+            if element.tag == 'pre':
+                for line in text.splitlines():
+                    name, sep, value = line.strip().partition('=')
+                    if sep and name.startswith('/'):
+                        counters[name] = status_value(value)
+                continue
+            text = ''.join(element.itertext())
+            pairs = status_pair_re.findall(text)
+            if 'elapsed=' not in text:
+                for name, value in pairs:
+                    counters[name.strip()] = status_value(value)
+                continue
+            details = dict((name.strip(), status_value(value))
+                           for name, value in pairs)
+            query_id = details.pop('queryId', None)
+            if query_id is None:
+                for field in element.iter('input'):
+                    if field.get('name') == 'queryId':
+                        query_id = field.get('value')
+            sparql = element.getnext()
+            queries.append(RunningQuery(
+                query_id, details.pop('elapsed'),
+                sparql.text if sparql is not None and sparql.tag == 'pre'
+                else None, details))
+        return cls(counters, queries, when if when is not None else
+                   time.time())
+
+    def delta(self, earlier):
+        """The change in each numeric counter since the earlier status, with
+        the seconds between them as 'seconds'."""
+        delta = {'seconds': self.time - earlier.time}
+        for name, value in self.counters.iteritems():
+            before = earlier.counters.get(name)
+            if isinstance(value, (int, float)) and \
+               isinstance(before, (int, float)):
+                delta[name] = value - before
+        return delta
+
+class QueryPlan(object):
+    """How Blazegraph ran a query, from :meth:`SPARQLServer.explain`.
+
+    sections holds the text of each part of the explanation by its heading
+    (such as 'Original AST', 'Optimized AST' and 'Query Plan'), and
+    operators a dictionary for each operator the query ran, in evaluation
+    order, of the statistics reported for it, including bopSummary (what
+    it is), fastRangeCount (the statements it could match), unitsIn and
+    unitsOut (the solutions it read and produced) and sumMillis (the time
+    it took). The statistics for the query as a whole are total."""
+
+    def __init__(self, sections, operators, total=None):
+        self.sections = sections
+        self.operators = operators
+        self.total = total or {}
+
+    @classmethod
+    def parse(cls, content):
+        html = etree.fromstring(content, etree.HTMLParser())
+        sections = OrderedDict()
+        heading = None
+        for element in html.iter():
+            if element.tag in ('h1', 'h2', 'h3'):
+                heading = ''.join(element.itertext()).strip()
+            elif element.tag == 'pre' and heading is not None:
+                sections[heading] = element.text or ''
+        operators = []
+        total = None
+        for table in html.iter('table'):
+            rows = table.findall('.//tr')
+            if not rows:
+                continue
+            columns = [''.join(cell.itertext()).strip()
+                       for cell in rows[0].findall('th')]
+            if 'bopId' not in columns:
+                continue
+            for row in rows[1:]:
+                cells = [''.join(cell.itertext()).strip()
+                         for cell in row.findall('td')]
+                if len(cells) != len(columns):
+                    continue
+                operator = dict((column, status_value(cell) if cell else None)
+                                for column, cell in zip(columns, cells))
+                if operator.get('evalOrder') == 'total':
+                    total = operator
+                else:
+                    operators.append(operator)
+        return cls(sections, operators, total)
+
+    @property
+    def millis(self):
+        """The milliseconds spent running the query."""
+        if self.total.get('sumMillis') is not None:
+            return self.total['sumMillis']
+        return sum(operator.get('sumMillis') or 0
+                   for operator in self.operators)
+
+    def slowest(self, n=5):
+        """The n operators that took longest."""
+        return sorted(self.operators, key=lambda operator:
+                      operator.get('sumMillis') or 0, reverse=True)[:n]
+
+class Transaction(object):
+    """A Blazegraph read/write transaction, from
+    :meth:`SPARQLServer.transaction`.
+
+    Queries, updates and inserts run through the transaction see its view
+    of the store, and none of its changes are visible to anyone else until
+    it is committed, which makes a single commit point for all of them.
+    Used as a context manager, the transaction commits when the block
+    finishes and aborts if it raises an exception.
+
+    server is a view of the :class:`SPARQLServer` that runs everything in
+    the transaction, for its other methods."""
+
+    def __init__(self, server, tx_id):
+        self.tx_id = tx_id
+        self.base = server
+        self.server = server.with_params(timestamp=tx_id)
+        self.url = server.service_url + '/tx/' + urllib.quote(str(tx_id))
+        self.state = 'active'
+
+    def __repr__(self):
+        return '<Transaction %s (%s)>' % (self.tx_id, self.state)
+
+    def query(self, sparql, *args, **kwargs):
+        return self.server.query(sparql, *args, **kwargs)
+
+    def query_iter(self, sparql, *args, **kwargs):
+        return self.server.query_iter(sparql, *args, **kwargs)
+
+    def update(self, sparql, **kwargs):
+        return self.server.update(sparql, **kwargs)
+
+    def insert(self, statements, *args, **kwargs):
+        return self.server.insert(statements, *args, **kwargs)
+
+    def _request(self, operation, ok=('200',)):
+        response, content = self.server.pool.request(
+            uri=self.url + '?' + operation, method='POST')
+        if response['status'] not in ok:
+            raise SPARQLQueryException('%s: %s\nTransaction: %s' %
+                                       (response, content, self.tx_id),
+                                       response.status)
+        return response, content
+
+    def status(self):
+        """The server's description of the transaction as a dictionary of its
+        attributes (txId, readsOnCommitTime, readOnly)."""
+        response, content = self._request('STATUS')
+        return transaction_descriptions(content)[0]
+
+    def prepare(self):
+        """Check that the transaction could commit. Returns False if its
+        writes conflict with a transaction already committed."""
+        response, content = self._request('PREPARE', ok=('200', '409'))
+        return response['status'] == '200'
+
+    def commit(self):
+        """Commit the transaction, making its changes visible."""
+        self._request('COMMIT')
+        self.state = 'committed'
+        self.base.invalidate_cache()
+
+    def abort(self):
+        """Abort the transaction, discarding its changes."""
+        self._request('ABORT')
+        self.state = 'aborted'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.state != 'active':
+            return
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+def transaction_descriptions(content):
+    """Read the attributes of each <tx> in a transaction API response."""
+    return [dict(tx.attrib) for tx in etree.fromstring(content).iter('tx')]
+
+def java_properties(properties):
+    """Serialize a dictionary as a Java properties file."""
+    def escape(value, key=False):
+        value = unicode(value).replace('\\', '\\\\').replace('\n', '\\n')
+        if key:
+            for c in ' =:':
+                value = value.replace(c, '\\' + c)
+        return value
+    return ''.join('%s=%s\n' % (escape(key, True), escape(value))
+                   for key, value in sorted(properties.items())).encode('utf-8')
+
+class NamespaceManager(object):
+    """Manages the namespaces (data sets) of a Blazegraph server through its
+    multi-tenancy API.
+
+    :meth:`server` hands out a :class:`SPARQLServer` for each namespace,
+    which is kept and reused for later calls. All of them share this
+    manager's connection pool, so a process talking to many namespaces still
+    only keeps one set of keep-alive connections to the server.
+
+    :param service_url: The root of the REST API, eg.
+        http://localhost:9999/bigdata.
+    :param server_class: The class of the servers to hand out.
+    :param server_kwargs: Passed on to server_class."""
+
+    namespace_predicate = 'http://www.bigdata.com/rdf#/features/KB/Namespace'
+    namespace_property = 'com.bigdata.rdf.sail.namespace'
+
+    def __init__(self, service_url, pool=None, server_class=SPARQLServer,
+                 **server_kwargs):
+        self.service_url = service_url.rstrip('/')
+        self.pool = pool if pool is not None else ConnectionPool()
+        self.server_class = server_class
+        self.server_kwargs = server_kwargs
+        self.servers = {}
+        self.lock = threading.Lock()
+
+    def namespace_url(self, namespace):
+        return self.service_url + '/namespace/' + urllib.quote(namespace, '')
+
+    def server(self, namespace):
+        """The :class:`SPARQLServer` for namespace."""
+        with self.lock:
+            server = self.servers.get(namespace)
+            if server is None:
+                server = self.servers[namespace] = self.server_class(
+                    self.namespace_url(namespace) + '/sparql', pool=self.pool,
+                    service_url=self.service_url, **self.server_kwargs)
+            return server
+
+    __getitem__ = server
+
+    def namespaces(self):
+        """Lists the names of the namespaces on the server."""
+        response, content = self.pool.request(
+            uri=self.service_url + '/namespace', method='GET',
+            headers={'Accept': 'text/plain'})
+        if response['status'] != '200':
+            raise SPARQLQueryException('%s: %s' % (response, content),
+                                       response.status)
+        names = []
+        def add(triple):
+            if triple.predicate.value == self.namespace_predicate:
+                names.append(triple.object.value)
+        ntriples_parser.parse_lines(content.splitlines(True), _CallbackSink(add))
+        return names
+
+    def __contains__(self, namespace):
+        return namespace in self.namespaces()
+
+    def properties(self, namespace):
+        """The configuration properties of namespace, as a dictionary."""
+        response, content = self.pool.request(
+            uri=self.namespace_url(namespace) + '/properties', method='GET',
+            headers={'Accept': 'application/xml'})
+        if response['status'] != '200':
+            raise SPARQLQueryException('%s: %s' % (response, content),
+                                       response.status)
+        return dict((entry.get('key'), entry.text or '') for entry in
+                    etree.fromstring(content).iter('entry'))
+
+    def create(self, namespace, properties=None):
+        """Creates a namespace.
+
+        :param properties: Configuration properties for the new namespace,
+            such as com.bigdata.rdf.store.AbstractTripleStore.quads; any not
+            given take the server's defaults.
+        :returns: The :class:`SPARQLServer` for the new namespace."""
+        properties = dict(properties or {})
+        properties[self.namespace_property] = namespace
+        response, content = self.pool.request(
+            uri=self.service_url + '/namespace', method='POST',
+            body=java_properties(properties),
+            headers={'Content-Type': 'text/plain; charset=utf-8'})
+        if response['status'] not in ('200', '201'):
+            raise SPARQLQueryException('%s: %s' % (response, content),
+                                       response.status)
+        return self.server(namespace)
+
+    def destroy(self, namespace):
+        """Destroys a namespace and all of its data."""
+        with self.lock:
+            self.servers.pop(namespace, None)
+        response, content = self.pool.request(
+            uri=self.namespace_url(namespace), method='DELETE')
+        if response['status'] != '200':
+            raise SPARQLQueryException('%s: %s' % (response, content),
+                                       response.status)
 
 class UpdateableGraphStore(SPARQLServer):
     """SPARQL server class that is capable of interacting with SPARQL 1.1
@@ -220,10 +2737,10 @@ class UpdateableGraphStore(SPARQLServer):
             return urlparse.urljoin(self.dataset_url, urllib.quote_plus(graph_uri))
 
     def get(self, graph_uri):
-        h = httplib2.Http()
-        resp, content = h.request(
+        resp, content = self.retry.call(lambda: self.pool.request(
             uri = self.request_url(graph_uri), method = 'GET',
-            headers = {'Accept': ','.join(self.acceptable_graph_responses),},)
+            headers = {'Accept': ','.join(self.acceptable_graph_responses),},),
+            True)
         if resp['status'] != '200':
             raise Exception('Error from Graph Store (%s): %s' %\
                             (resp['status'], content))
@@ -239,37 +2756,45 @@ class UpdateableGraphStore(SPARQLServer):
         return graph
 
     def delete(self, graph_uri):
-        h = httplib2.Http()
-        resp, content = h.request(uri = self.request_url(graph_uri),
-                                  method = 'DELETE')
+        try:
+            resp, content = self.pool.request(uri = self.request_url(graph_uri),
+                                              method = 'DELETE')
+        finally:
+            self.invalidate_cache()
         if resp['status'] != '200' and resp['status'] != '202':
             raise Exception('Error from Graph Store (%s): %s' %\
                             (resp['status'], content))
 
     def put(self, graph_uri, graph):
-        h = httplib2.Http()
-        graph_triples = graph.serialize(format = 'nt')
-        resp, content = h.request(uri = self.request_url(graph_uri),
-                                  method = 'PUT', body = graph_triples,
-                                  headers = {'content-type': 'text/plain',},)
+        headers = {'content-type': 'text/plain',}
+        graph_triples = self.encode_upload(graph.serialize(format = 'nt'),
+                                           headers)
+        try:
+            resp, content = self.pool.request(uri = self.request_url(graph_uri),
+                                              method = 'PUT', body = graph_triples,
+                                              headers = headers,)
+        finally:
+            self.invalidate_cache()
         if resp['status'] not in ('200', '201', '204'):
             raise Exception('Error from Graph Store (%s): %s' %\
                             (resp['status'], content))
 
     def post(self, graph_uri, graph):
-        h = httplib2.Http()
-        graph_triples = graph.serialize(format = 'nt')
+        headers = {'content-type': 'text/plain',}
+        graph_triples = self.encode_upload(graph.serialize(format = 'nt'),
+                                           headers)
+        try:
+            resp, content = self.pool.request(
+                uri = self.request_url(graph_uri) if graph_uri != None
+                else self.dataset_url,
+                method = 'POST', body = graph_triples, headers = headers,)
+        finally:
+            self.invalidate_cache()
         if graph_uri != None:
-            resp, content = h.request(uri = self.request_url(graph_uri),
-                                      method = 'POST', body = graph_triples,
-                                      headers = {'content-type': 'text/plain',},)
             if resp['status'] not in ('200', '201', '204'):
                 raise Exception('Error from Graph Store (%s): %s' %\
                                 (resp['status'], content))
         else:
-            resp, content = h.request(uri = self.dataset_url, method = 'POST',
-                                      body = graph_triples,
-                                      headers = {'content-type': 'text/plain',},)
             if resp['status'] != '201':
                 raise Exception('Error from Graph Store (%s): %s' %\
                                 (resp['status'], content))
@@ -279,11 +2804,13 @@ class PatchableGraphStore(UpdateableGraphStore):
     RDF graphs."""
 
     def patch(self, graph_uri, changeset):
-        h = httplib2.Http()
         graph_xml = changeset.serialize(format = 'xml', encoding='utf-8')
-        resp, content = h.request(
-            uri = self.request_url(graph_uri), method = 'PATCH', body = graph_xml,
-            headers = {'content-type': 'application/vnd.talis.changeset+xml',},)
+        try:
+            resp, content = self.pool.request(
+                uri = self.request_url(graph_uri), method = 'PATCH', body = graph_xml,
+                headers = {'content-type': 'application/vnd.talis.changeset+xml',},)
+        finally:
+            self.invalidate_cache()
         if resp['status'] not in ('200', '201', '204'):
             raise Exception('Error from Graph Store (%s): %s' %\
                             (resp['status'], content))
@@ -323,3 +2850,443 @@ def differences(a, b, exclude=[]):
     exclude = [rdflib.URIRef(excluded) for excluded in exclude]
     return ([s for s in a if s not in b and s[1] not in exclude],
             [s for s in b if s not in a and s[1] not in exclude])
+
+class AsyncSPARQLServer(object):
+    """A SPARQL server whose requests run concurrently in the background.
+
+    Each method mirrors the one on :class:`SPARQLServer` but returns a
+    :class:`Future` at once rather than blocking until the response
+    arrives. Requests run on a :class:`WorkerPool` of max_concurrency
+    threads over a shared :class:`ConnectionPool`, so at most that many are
+    in flight at a time. The Future from :meth:`query_iter` gives
+    :class:`SPARQLResults` that stream from the server as they are read;
+    each holds a connection until it is read to the end or closed, so close
+    any that are abandoned. (There is no asyncio event loop to drive
+    requests from in Python 2.)
+
+    Unless given a pool, the server gets one with room for twice
+    max_concurrency connections, leaving some for streamed results still
+    being read, which gives up with :class:`ConnectionPoolException` after
+    pool_wait seconds waiting for a connection rather than hanging.
+
+    Other keyword arguments are passed to the underlying server, available
+    as the server attribute."""
+
+    server_class = SPARQLServer
+    pool_wait = 30
+
+    def __init__(self, *args, **kwargs):
+        max_concurrency = kwargs.pop('max_concurrency', 10)
+        if kwargs.get('pool') is None:
+            kwargs['pool'] = ConnectionPool(max_size=2 * max_concurrency,
+                                            wait=self.pool_wait)
+        self.server = self.server_class(*args, **kwargs)
+        self.workers = WorkerPool(max_concurrency)
+
+    def query(self, sparql, *args, **kwargs):
+        return self.workers.submit(self.server.query, sparql, *args, **kwargs)
+
+    def query_iter(self, sparql, *args, **kwargs):
+        return self.workers.submit(self.server.query_iter, sparql, *args,
+                                   **kwargs)
+
+    def update(self, sparql, **kwargs):
+        return self.workers.submit(self.server.update, sparql, **kwargs)
+
+    def close(self):
+        """Stop the worker threads once pending requests have run."""
+        self.workers.shutdown()
+
+class AsyncUpdateableGraphStore(AsyncSPARQLServer):
+    """An :class:`AsyncSPARQLServer` for SPARQL 1.1 graph stores, whose
+    graph methods mirror :class:`UpdateableGraphStore`."""
+
+    server_class = UpdateableGraphStore
+
+    def get(self, graph_uri):
+        return self.workers.submit(self.server.get, graph_uri)
+
+    def put(self, graph_uri, graph):
+        return self.workers.submit(self.server.put, graph_uri, graph)
+
+    def post(self, graph_uri, graph):
+        return self.workers.submit(self.server.post, graph_uri, graph)
+
+    def delete(self, graph_uri):
+        return self.workers.submit(self.server.delete, graph_uri)
+
+class ClusterNode(object):
+    """One endpoint of a :class:`ClusterSPARQLServer`: its server, whether it
+    is healthy, and the requests from this client in flight to it, sent to
+    it and failed on it."""
+
+    def __init__(self, server):
+        self.server = server
+        self.healthy = True
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+
+    def __repr__(self):
+        return '<ClusterNode %s (%s, %d in flight)>' % (
+            self.server.query_url, 'healthy' if self.healthy else 'ejected',
+            self.in_flight)
+
+class ClusterSPARQLServer(object):
+    """A SPARQL server made of several replicas of one store, such as a
+    Blazegraph HA replication cluster.
+
+    Reads are spread over the healthy endpoints, either in turn
+    ('round_robin') or to whichever has fewest requests in flight from this
+    client ('least_loaded'). A read that fails because its endpoint is down
+    or overloaded (a connection error or 5xx status) ejects the endpoint and
+    is tried again on the next one, so callers only see an error when every
+    endpoint has failed. Updates always go to the leader, by default the
+    first endpoint, and are never sent anywhere else.
+
+    Every health_interval seconds (if not None) a background thread reads
+    the status page of each endpoint, ejecting those that don't answer and
+    bringing back those that do; :meth:`check_health` does the same on
+    demand.
+
+    All the endpoints share one :class:`ConnectionPool`, and cache results
+    under the leader's namespace, so that a write through the leader
+    invalidates what was cached from every replica. Other keyword
+    arguments are passed to each endpoint's :class:`SPARQLServer`. Unless
+    given a retry policy, the replicas make a single attempt per read,
+    leaving failover to the cluster rather than retrying a failing
+    endpoint first; the leader, which has nothing to fail over to, keeps
+    the usual retries."""
+
+    server_class = SPARQLServer
+    strategies = ('round_robin', 'least_loaded')
+
+    def __init__(self, endpoints, leader=None, strategy='round_robin',
+                 health_interval=10, pool=None, **kwargs):
+        if strategy not in self.strategies:
+            raise ValueError('Unknown strategy %r' % strategy)
+        self.strategy = strategy
+        self.pool = pool if pool is not None else ConnectionPool()
+        if not endpoints:
+            raise ValueError('A cluster needs at least one endpoint')
+        leader = leader if leader is not None else endpoints[0]
+        self.namespace = blazegraph_namespace(leader)
+        self.leader = self._server(leader, kwargs)
+        self.nodes = []
+        for endpoint in endpoints:
+            node_kwargs = kwargs
+            if kwargs.get('retry') is None:
+                node_kwargs = dict(kwargs, retry=RetryPolicy(max_attempts=1))
+            self.nodes.append(ClusterNode(self._server(endpoint,
+                                                       node_kwargs)))
+        self.health_interval = health_interval
+        self._next = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        if health_interval is not None:
+            thread = threading.Thread(target=self._check_health_periodically)
+            thread.daemon = True
+            thread.start()
+
+    def _server(self, endpoint, kwargs):
+        server = self.server_class(endpoint, pool=self.pool, **kwargs)
+        server.namespace = self.namespace
+        return server
+
+    def _choose(self, tried):
+        """The next node to send a read to, preferring healthy ones."""
+        with self._lock:
+            candidates = [node for node in self.nodes if node not in tried]
+            if not candidates:
+                return None
+            healthy = [node for node in candidates if node.healthy]
+            candidates = healthy or candidates
+            if self.strategy == 'least_loaded':
+                least = min(node.in_flight for node in candidates)
+                candidates = [node for node in candidates
+                              if node.in_flight == least]
+            start = self._next % len(self.nodes)
+            node = min(candidates, key=lambda node: (
+                self.nodes.index(node) - start) % len(self.nodes))
+            self._next = self.nodes.index(node) + 1
+            node.in_flight += 1
+            node.requests += 1
+            return node
+
+    def is_node_failure(self, error):
+        """Whether error means the endpoint rather than the request failed."""
+        if isinstance(error, RetryPolicy.connection_errors):
+            return True
+        return isinstance(error, SPARQLQueryException) and \
+            not isinstance(error, DeadlineExceededException) and \
+            error.status is not None and error.status >= 500
+
+    def read(self, method, *args, **kwargs):
+        """Call the named method of a replica's :class:`SPARQLServer`,
+        failing over to the others. A read that fails part way through,
+        such as :meth:`get_statements` into a callable, is repeated in
+        full."""
+        tried = []
+        while True:
+            node = self._choose(tried)
+            if node is None:
+                raise error
+            tried.append(node)
+            try:
+                return getattr(node.server, method)(*args, **kwargs)
+            except Exception as e:
+                if not self.is_node_failure(e):
+                    raise
+                error = e
+                with self._lock:
+                    node.failures += 1
+                    node.healthy = False
+                log.warning('Ejected %s after %r', node.server.query_url, e)
+            finally:
+                with self._lock:
+                    node.in_flight -= 1
+
+    def check_health(self):
+        """Check every endpoint now, ejecting or restoring each."""
+        for node in self.nodes:
+            try:
+                response, content = self.pool.request(
+                    node.server.service_url + '/status', 'GET')
+                healthy = response.status == 200
+            except Exception:
+                healthy = False
+            with self._lock:
+                if healthy != node.healthy:
+                    log.warning('%s %s', 'Restored' if healthy else 'Ejected',
+                                node.server.query_url)
+                node.healthy = healthy
+
+    def _check_health_periodically(self):
+        while not self._closed.wait(self.health_interval):
+            self.check_health()
+
+    def close(self):
+        """Stop checking the health of the endpoints."""
+        self._closed.set()
+
+    def query(self, sparql, *args, **kwargs):
+        return self.read('query', sparql, *args, **kwargs)
+
+    def query_iter(self, sparql, *args, **kwargs):
+        return self.read('query_iter', sparql, *args, **kwargs)
+
+    def query_columns(self, sparql, *args, **kwargs):
+        return self.read('query_columns', sparql, *args, **kwargs)
+
+    def estimate_cardinality(self, *args, **kwargs):
+        return self.read('estimate_cardinality', *args, **kwargs)
+
+    def has_statement(self, *args, **kwargs):
+        return self.read('has_statement', *args, **kwargs)
+
+    def get_statements(self, *args, **kwargs):
+        return self.read('get_statements', *args, **kwargs)
+
+    def update(self, sparql, **kwargs):
+        return self.leader.update(sparql, **kwargs)
+
+    def insert(self, statements, *args, **kwargs):
+        return self.leader.insert(statements, *args, **kwargs)
+
+    def bulk_load(self, source, progress=None, **kwargs):
+        return self.leader.bulk_load(source, progress, **kwargs)
+
+    def delete_matching(self, *args, **kwargs):
+        return self.leader.delete_matching(*args, **kwargs)
+
+    def transaction(self, timestamp=None):
+        return self.leader.transaction(timestamp)
+
+class BulkLoadException(Exception):
+    """Raised when some batches of a bulk load failed after every attempt. The
+    :class:`LoadReport` of the whole load is available as report."""
+
+    def __init__(self, report):
+        failed = report.failed
+        super(BulkLoadException, self).__init__(
+            '%d of %d batches failed, first with: %s' %
+            (len(failed), len(report.batches), failed[0].error))
+        self.report = report
+
+class BatchResult(namedtuple('BatchResult', 'index statements size modified '
+                                            'seconds attempts error')):
+    """How one batch of a bulk load went: its position in the input, the
+    statements and bytes it held, the statements the store reported
+    modified, the seconds it took, the attempts made, and the exception
+    that made its final attempt fail (or None if it succeeded)."""
+
+    __slots__ = ()
+
+    @property
+    def statements_per_second(self):
+        return self.statements / self.seconds if self.seconds else 0.0
+
+class LoadReport(object):
+    """The :class:`BatchResult` of every batch of a bulk load, in order."""
+
+    def __init__(self, batches, seconds):
+        self.batches = batches
+        self.seconds = seconds
+
+    @property
+    def failed(self):
+        return [batch for batch in self.batches if batch.error is not None]
+
+    @property
+    def statements(self):
+        return sum(batch.statements for batch in self.batches)
+
+    @property
+    def modified(self):
+        return sum(batch.modified for batch in self.batches)
+
+    @property
+    def statements_per_second(self):
+        return self.statements / self.seconds if self.seconds else 0.0
+
+class BulkLoader(object):
+    """Loads large amounts of RDF into a :class:`SPARQLServer` by splitting
+    it into batches that are POSTed concurrently, each retried on its own.
+
+    Only a few batches are held in memory at a time: reading the input
+    waits while every worker is busy and as many batches again are queued.
+
+    A batch is retried only after a connection error or a status in the
+    retry policy's retry_statuses (by default 5xx); a rejected batch, such
+    as one with a syntax error, fails straight away.
+
+    Batches are split between lines without parsing them, and the store
+    reads each POST on its own, so a blank node label (_:b0) used in more
+    than one batch names a different node in each. Input whose blank nodes
+    are shared between distant lines should be skolemized (given IRIs)
+    first, or loaded in a single batch with a large enough batch_size.
+
+    :param server: The server to load into.
+    :param workers: How many batches to send at once.
+    :param batch_size: Roughly how many bytes of N-Quads or N-Triples to send
+        per batch.
+    :param max_attempts: How many times to try a batch before giving up on it.
+    :param retry_delay: Seconds to wait before retrying a batch, doubled for
+        each further attempt.
+    :param format: 'nquads' or 'ntriples'.
+    :param retry: The :class:`RetryPolicy` for batches, whose retries and
+        exhausted count every batch; by default one made from max_attempts
+        and retry_delay."""
+
+    failure_errors = (SPARQLQueryException, ConnectionPoolException) + \
+        RetryPolicy.connection_errors
+
+    def __init__(self, server, workers=4, batch_size=8 * 1024 * 1024,
+                 max_attempts=3, retry_delay=1, format='nquads', retry=None):
+        self.server = server
+        self.workers = workers
+        self.batch_size = batch_size
+        self.format = format
+        self.retry = retry if retry is not None else \
+            RetryPolicy(max_attempts=max_attempts, backoff=retry_delay)
+
+    def lines(self, source):
+        """Generate lines of N-Quads or N-Triples from source: a file name, a
+        file-like object of N-Quads or N-Triples, or an iterable of Triple and
+        Quad."""
+        if isinstance(source, basestring):
+            with open(source, 'rb') as f:
+                for line in f:
+                    yield line
+        elif hasattr(source, 'read'):
+            for line in source:
+                yield line
+        else:
+            for chunk in serialize_chunks(source, 0,
+                                          quads=(self.format == 'nquads')):
+                yield chunk
+
+    def batches(self, source):
+        """Generate (lines, statements, size) batches of about batch_size bytes
+        from source, without parsing any of it."""
+        lines = []
+        statements = 0
+        size = 0
+        for line in self.lines(source):
+            lines.append(line)
+            size += len(line)
+            stripped = line.strip()
+            if stripped and not stripped.startswith('#'):
+                statements += 1
+            if size >= self.batch_size:
+                yield lines, statements, size
+                lines = []
+                statements = 0
+                size = 0
+        if lines:
+            yield lines, statements, size
+
+    def send(self, index, lines, statements, size):
+        """POST one batch, retrying it as the retry policy allows (adding the
+        same statements twice does no harm), and return its
+        :class:`BatchResult`."""
+        server = self.server
+        headers = {'Content-Type': server.rdf_content_types[self.format]}
+        body = server.encode_upload(''.join(lines), headers)
+        uri = server.access_path_url(None, {})
+        start = time.time()
+        attempts = [0]
+
+        def post():
+            attempts[0] += 1
+            return server.pool.request(uri=uri, method='POST', body=body,
+                                       headers=headers)
+
+        try:
+            try:
+                response, content = self.retry.call(post, True)
+            finally:
+                server.invalidate_cache()
+            if response['status'] != '200':
+                raise SPARQLQueryException('%s: %s' % (response, content),
+                                           response.status)
+            modified = mutation_count(content)
+        except self.failure_errors as e:
+            log.error('Giving up on batch %d after %d attempts: %s',
+                      index, attempts[0], e)
+            return BatchResult(index, statements, size, 0,
+                               time.time() - start, attempts[0], e)
+        result = BatchResult(index, statements, size, modified,
+                             time.time() - start, attempts[0], None)
+        log.debug('Loaded batch %d: %d statements in %.3fs (%.0f/s)',
+                  index, statements, result.seconds,
+                  result.statements_per_second)
+        return result
+
+    def load(self, source, progress=None):
+        """Load everything in source (see :meth:`lines`).
+
+        :param progress: Called with the :class:`BatchResult` of each batch as
+            it finishes, from a worker thread.
+        :returns: A :class:`LoadReport`.
+        :raises BulkLoadException: If any batch failed every attempt."""
+        def report_progress(future):
+            if future.exception() is None:
+                progress(future.result())
+
+        start = time.time()
+        workers = WorkerPool(self.workers, queue_size=self.workers)
+        futures = []
+        try:
+            for index, batch in enumerate(self.batches(source)):
+                future = workers.submit(self.send, index, *batch)
+                if progress is not None:
+                    future.add_done_callback(report_progress)
+                futures.append(future)
+            results = [future.result() for future in futures]
+        finally:
+            workers.shutdown()
+        report = LoadReport(results, time.time() - start)
+        if report.failed:
+            raise BulkLoadException(report)
+        return report
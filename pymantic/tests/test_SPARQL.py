@@ -1,10 +1,43 @@
+import BaseHTTPServer
+from cStringIO import StringIO
+import datetime
+import httplib
+import re
+import socket
+import SocketServer
+import threading
+import time
 import urllib
+import urlparse
 import unittest
+import zlib
 from nose import SkipTest
+import pytz
+import rdflib
+import simplejson
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 import mock_http
 
-# from pymantic.sparql import SPARQLServer, SPARQLQueryException
+from pymantic.sparql import AsyncSPARQLServer, BulkLoader, \
+     BulkLoadException, ClusterSPARQLServer, ColumnarResults, \
+     ConnectionPool, ConnectionPoolException, CSVResults, \
+     DeadlineExceededException, JSONResults, NamespaceManager, \
+     PreparedQuery, QueryPlan, ResultCache, \
+     RetryPolicy, \
+     ServerStatus, SPARQLServer, SPARQLQueryException, TermDecoder, \
+     Transaction, UpdateableGraphStore, \
+     TSVResults, WorkerPool, XMLResults
+from pymantic.parsers import nquads_parser
+from pymantic.primitives import BlankNode, Dataset, Literal, NamedNode, \
+     Quad, Triple
+
+XSD_INTEGER = 'http://www.w3.org/2001/XMLSchema#integer'
+XSD_DOUBLE = 'http://www.w3.org/2001/XMLSchema#double'
+XSD_DATETIME = 'http://www.w3.org/2001/XMLSchema#dateTime'
 
 class TestSparql(unittest.TestCase):
     def setUp(self):
@@ -47,3 +80,1451 @@ class TestSparql(unittest.TestCase):
             self.assertRaises(SPARQLQueryException, sparql.query, test_query)
         finally:
             self.assert_(self.mock_endpoint.verify())
+
+class RecordingHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Records each request and answers it with the server's responder."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def read_body(self):
+        if self.headers.get('transfer-encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                if not size:
+                    return ''.join(chunks)
+        length = int(self.headers.get('content-length', 0))
+        return self.rfile.read(length) if length else ''
+
+    def handle_request(self):
+        body = self.read_body()
+        self.server.requests.append((self.command, self.path, self.headers,
+                                     body, self.client_address))
+        status, headers, content = self.server.responder(self)
+        self.send_response(status)
+        for name, value in headers.iteritems():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+    def log_message(self, *args):
+        pass
+
+class LocalHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """An HTTP server on a background thread, for tests that need a real
+    socket to talk to."""
+
+    daemon_threads = True
+
+    def __init__(self, responder):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           RecordingHandler)
+        self.responder = responder
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        pass
+
+def json_responder(content):
+    return lambda handler: (
+        200, {'Content-Type': 'application/sparql-results+json'}, content)
+
+class TestConnectionPool(unittest.TestCase):
+    test_json = '{"head": {"vars": ["s"]}, "results": {"bindings": [{"s": {"type": "uri", "value": "http://example.com/s"}}]}}'
+
+    def setUp(self):
+        self.http = LocalHTTPServer(json_responder(self.test_json))
+
+    def tearDown(self):
+        self.http.stop()
+
+    def testKeepAlive(self):
+        """Consecutive queries reuse one pooled connection."""
+        sparql = SPARQLServer(self.http.url + '/bigdata/sparql')
+        for i in range(3):
+            results = sparql.query('SELECT ?s WHERE { ?s ?p ?o }')
+            self.assertEqual(results['results']['bindings'][0]['s']['value'],
+                             'http://example.com/s')
+        self.assertEqual(len(self.http.requests), 3)
+        self.assertEqual(len(set(r[4] for r in self.http.requests)), 1)
+
+    def testSharedPool(self):
+        """Servers sharing a pool share its connections."""
+        pool = ConnectionPool(max_size=1)
+        first = SPARQLServer(self.http.url + '/a/sparql', pool=pool)
+        second = SPARQLServer(self.http.url + '/b/sparql', pool=pool)
+        first.query('ASK {}')
+        second.query('ASK {}')
+        self.assertEqual(len(set(r[4] for r in self.http.requests)), 1)
+
+    def testPerHostLimit(self):
+        pool = ConnectionPool(max_per_host=1, wait=0)
+        key = pool.host_key(self.http.url)
+        connection, reused = pool.acquire(key)
+        self.assertFalse(reused)
+        self.assertRaises(ConnectionPoolException, pool.acquire, key)
+        pool.release(key, connection)
+        self.assertEqual(pool.acquire(key), (connection, True))
+
+    def testIdleEviction(self):
+        pool = ConnectionPool(max_idle=0)
+        key = pool.host_key(self.http.url)
+        connection, reused = pool.acquire(key)
+        pool.release(key, connection)
+        self.assertFalse(pool.acquire(key)[1])
+
+    def testTimeoutNotResent(self):
+        """A reused connection that times out waiting for the response isn't
+        silently sent the request again."""
+        def respond(handler):
+            if handler.command == 'POST':
+                time.sleep(1)
+                return 200, {'Content-Type': 'application/xml'}, \
+                    '<data modified="1" milliseconds="0"/>'
+            return json_responder(self.test_json)(handler)
+        self.http.responder = respond
+        sparql = SPARQLServer(self.http.url + '/bigdata/sparql',
+                              pool=ConnectionPool(timeout=0.5))
+        sparql.query('ASK {}')
+        self.assertRaises(socket.timeout, sparql.update,
+                          'INSERT DATA { <a:s> <a:p> 1 }')
+        self.assertEqual([r[0] for r in self.http.requests], ['GET', 'POST'])
+        self.assertEqual(dict(sparql.retry.retries), {})
+
+    def testRedirect(self):
+        """GET requests follow redirects."""
+        def respond(handler):
+            if handler.path.startswith('/old'):
+                return 301, {'Location': handler.path.replace('/old', '/new')}, ''
+            return json_responder(self.test_json)(handler)
+        self.http.responder = respond
+        sparql = SPARQLServer(self.http.url + '/old/sparql')
+        results = sparql.query('SELECT ?s WHERE { ?s ?p ?o }')
+        self.assertEqual(results['results']['bindings'][0]['s']['value'],
+                         'http://example.com/s')
+        self.assertEqual([r[1].split('?')[0] for r in self.http.requests],
+                         ['/old/sparql', '/new/sparql'])
+
+    def testProxy(self):
+        """HTTP requests go through the proxy with absolute URIs."""
+        pool = ConnectionPool(proxies={'http': 'http://user:pw@' +
+                                       self.http.url[len('http://'):]})
+        sparql = SPARQLServer('http://sparql.example.com/sparql', pool=pool)
+        sparql.query('ASK {}')
+        command, path, headers, body, address = self.http.requests[0]
+        self.assertTrue(path.startswith('http://sparql.example.com/sparql?'))
+        self.assertEqual(headers['proxy-authorization'], 'Basic dXNlcjpwdw==')
+
+class TestStreamingResults(unittest.TestCase):
+    test_json = u'{"head": {"vars": ["product", "title", "count"]}, "results": {"bindings": [{"product": {"type": "uri", "value": "test_product"}, "title": {"xml:lang": "en", "type": "literal", "value": "Test Title \u00e9"}}, {"count": {"datatype": "http://www.w3.org/2001/XMLSchema#integer", "type": "literal", "value": "12345"}}, {}]}}'.encode('utf-8')
+
+    def testJSONResults(self):
+        """Bindings are streamed, whatever the chunk boundaries."""
+        expected = simplejson.loads(self.test_json)
+        for chunk_size in (1, 7, 65536):
+            results = JSONResults(StringIO(self.test_json), chunk_size)
+            self.assertEqual(results.vars, ['product', 'title', 'count'])
+            self.assertEqual(list(results), expected['results']['bindings'])
+
+    def testJSONBoolean(self):
+        results = JSONResults(StringIO('{ "head" : { } , "boolean" : true }'))
+        self.assertEqual(list(results), [])
+        self.assertEqual(results.boolean, True)
+
+    def testJSONNoBindings(self):
+        results = JSONResults(StringIO(
+            '{"results": {"bindings": []}, "head": {"vars": ["s"]}}'))
+        self.assertEqual(list(results), [])
+        self.assertEqual(results.vars, ['s'])
+
+    def testJSONTruncated(self):
+        results = JSONResults(StringIO(self.test_json[:-20]), 16)
+        self.assertRaises(ValueError, list, results)
+
+    test_xml = u"""<?xml version="1.0"?>
+<sparql xmlns="http://www.w3.org/2005/sparql-results#">
+  <head>
+    <variable name="product"/>
+    <variable name="title"/>
+    <variable name="count"/>
+  </head>
+  <results>
+    <result>
+      <binding name="product"><uri>test_product</uri></binding>
+      <binding name="title"><literal xml:lang="en">Test Title \u00e9</literal></binding>
+    </result>
+    <result>
+      <binding name="count"><literal datatype="http://www.w3.org/2001/XMLSchema#integer">12345</literal></binding>
+    </result>
+    <result/>
+  </results>
+</sparql>""".encode('utf-8')
+
+    def testXMLResults(self):
+        """XML results stream the same bindings as JSON results."""
+        expected = simplejson.loads(self.test_json)
+        results = XMLResults(StringIO(self.test_xml))
+        self.assertEqual(results.vars, ['product', 'title', 'count'])
+        self.assertEqual(list(results), expected['results']['bindings'])
+
+    def testXMLBoolean(self):
+        results = XMLResults(StringIO(
+            '<sparql xmlns="http://www.w3.org/2005/sparql-results#">'
+            '<head/><boolean>false</boolean></sparql>'))
+        self.assertEqual(list(results), [])
+        self.assertEqual(results.boolean, False)
+
+    def testQueryIterXML(self):
+        http = LocalHTTPServer(lambda handler: (
+            200, {'Content-Type': 'application/sparql-results+xml'},
+            self.test_xml))
+        try:
+            sparql = SPARQLServer(http.url + '/bigdata/sparql')
+            results = sparql.query_iter('SELECT * WHERE { ?s ?p ?o }',
+                                        output='xml')
+            self.assertEqual(len(list(results)), 3)
+            self.assertTrue('sparql-results+xml' in
+                            http.requests[0][2]['accept'])
+        finally:
+            http.stop()
+
+    test_tsv = (u'?product\t?title\t?count\n'
+                u'<test_product>\t"Test Title \u00e9"@en\t\n'
+                u'\t\t"12345"^^<http://www.w3.org/2001/XMLSchema#integer>\n'
+                u'\t\t\n').encode('utf-8')
+
+    def testTSVResults(self):
+        """TSV results stream the same bindings as JSON results."""
+        expected = simplejson.loads(self.test_json)
+        results = TSVResults(StringIO(self.test_tsv))
+        self.assertEqual(results.vars, ['product', 'title', 'count'])
+        self.assertEqual(list(results), expected['results']['bindings'])
+
+    def testQueryTSV(self):
+        """query decodes TSV results into the shape of JSON ones."""
+        http = LocalHTTPServer(lambda handler: (
+            200, {'Content-Type': 'text/tab-separated-values'},
+            self.test_tsv))
+        try:
+            sparql = SPARQLServer(http.url + '/bigdata/sparql')
+            self.assertEqual(sparql.query('SELECT * WHERE { ?s ?p ?o }',
+                                          output='tsv'),
+                             simplejson.loads(self.test_json))
+        finally:
+            http.stop()
+
+    def testTSVAbbreviations(self):
+        results = TSVResults(StringIO(
+            '?s\t?n\n_:b0\t-42\n_:b1\t"a \\"quoted\\"\\ttab"\n'
+            '_:b2\t1.5e3\n_:b3\ttrue\n'))
+        self.assertEqual([b['n'] for b in results], [
+            {'type': 'literal', 'value': '-42', 'datatype': XSD_INTEGER},
+            {'type': 'literal', 'value': 'a "quoted"\ttab'},
+            {'type': 'literal', 'value': '1.5e3', 'datatype': XSD_DOUBLE},
+            {'type': 'literal', 'value': 'true',
+             'datatype': 'http://www.w3.org/2001/XMLSchema#boolean'}])
+
+    def testCSVResults(self):
+        results = CSVResults(StringIO(
+            's,label\r\nhttp://example.com/s,"Hello, world"\r\n_:b0,\r\n'))
+        self.assertEqual(results.vars, ['s', 'label'])
+        self.assertEqual(list(results), [
+            {'s': {'type': 'uri', 'value': 'http://example.com/s'},
+             'label': {'type': 'literal', 'value': 'Hello, world'}},
+            {'s': {'type': 'bnode', 'value': 'b0'}}])
+
+    def testTermDecoder(self):
+        decoder = TermDecoder(['s', 'o', 'class'])
+        first = decoder.row({
+            's': {'type': 'uri', 'value': 'http://example.com/s'},
+            'o': {'type': 'literal', 'value': '1', 'datatype': XSD_INTEGER}})
+        second = decoder.row({
+            's': {'type': 'bnode', 'value': 'b0'},
+            'o': {'type': 'literal', 'value': '2', 'datatype': XSD_INTEGER},
+            'class': {'type': 'uri', 'value': 'http://example.com/s'}})
+        third = decoder.row({'s': {'type': 'bnode', 'value': 'b0'}})
+        self.assertEqual(first, (NamedNode('http://example.com/s'),
+                                 Literal('1', datatype=NamedNode(XSD_INTEGER)),
+                                 None))
+        self.assertEqual(first.s, NamedNode('http://example.com/s'))
+        self.assertTrue(first.s is second[2])
+        self.assertTrue(first.o.datatype is second.o.datatype)
+        self.assertTrue(isinstance(second.s, BlankNode))
+        self.assertTrue(second.s is third.s)
+
+    def testQueryIterDecode(self):
+        http = LocalHTTPServer(json_responder(self.test_json))
+        try:
+            sparql = SPARQLServer(http.url + '/bigdata/sparql')
+            rows = list(sparql.query_iter('SELECT * WHERE { ?s ?p ?o }',
+                                          decode=True))
+        finally:
+            http.stop()
+        self.assertEqual(rows[0].title, Literal(u'Test Title \u00e9', 'en'))
+        self.assertEqual(rows[1].count.value, '12345')
+        self.assertEqual(rows[2], (None, None, None))
+
+    def testColumnarResults(self):
+        if numpy is None:
+            raise SkipTest
+        doc = simplejson.dumps({
+            'head': {'vars': ['s', 'n', 'x', 'when']},
+            'results': {'bindings': [
+                {'s': {'type': 'uri', 'value': 'http://example.com/a'},
+                 'n': {'type': 'literal', 'value': '1', 'datatype': XSD_INTEGER},
+                 'x': {'type': 'literal', 'value': '1.5', 'datatype': XSD_DOUBLE},
+                 'when': {'type': 'literal', 'value': '2015-01-01T01:00:00+01:00',
+                          'datatype': XSD_DATETIME}},
+                {'s': {'type': 'uri', 'value': 'http://example.com/b'},
+                 'n': {'type': 'literal', 'value': '2', 'datatype': XSD_INTEGER},
+                 'when': {'type': 'literal', 'value': '2015-01-02T00:00:00Z',
+                          'datatype': XSD_DATETIME}},
+                {'s': {'type': 'uri', 'value': 'http://example.com/a'},
+                 'n': {'type': 'literal', 'value': '3', 'datatype': XSD_INTEGER}},
+            ]}})
+        columns = ColumnarResults(JSONResults(StringIO(doc)))
+        self.assertEqual(columns.row_count, 3)
+        self.assertEqual(list(columns), ['s', 'n', 'x', 'when'])
+        self.assertEqual(list(columns['s'].codes), [0, 1, 0])
+        self.assertEqual(columns['s'].dictionary,
+                         [NamedNode('http://example.com/a'),
+                          NamedNode('http://example.com/b')])
+        self.assertTrue(columns['s'].values is None)
+        self.assertEqual(columns['n'].values.dtype, numpy.int64)
+        self.assertEqual(columns['n'].values.sum(), 6)
+        self.assertEqual(list(columns['x'].codes), [0, -1, -1])
+        self.assertEqual(columns['x'].values[0], 1.5)
+        self.assertTrue(numpy.isnan(columns['x'].values[1:]).all())
+        self.assertEqual(list(columns['when'].values[:2]),
+                         [numpy.datetime64('2015-01-01T00:00:00', 'us'),
+                          numpy.datetime64('2015-01-02T00:00:00', 'us')])
+        self.assertTrue(numpy.isnat(columns['when'].values[2]))
+
+    def testColumnarBadValues(self):
+        """Values that don't fit a typed array don't fail the query."""
+        if numpy is None:
+            raise SkipTest
+        doc = simplejson.dumps({
+            'head': {'vars': ['big', 'bad']},
+            'results': {'bindings': [
+                {'big': {'type': 'literal', 'value': '123456789012345678901234',
+                         'datatype': XSD_INTEGER},
+                 'bad': {'type': 'literal', 'value': 'many',
+                         'datatype': XSD_INTEGER}},
+                {'big': {'type': 'literal', 'value': '1',
+                         'datatype': XSD_INTEGER},
+                 'bad': {'type': 'literal', 'value': '2',
+                         'datatype': XSD_INTEGER}},
+            ]}})
+        columns = ColumnarResults(JSONResults(StringIO(doc)))
+        self.assertEqual(columns['big'].values.dtype, numpy.float64)
+        self.assertEqual(list(columns['big'].values),
+                         [123456789012345678901234.0, 1.0])
+        self.assertTrue(columns['bad'].values is None)
+        self.assertEqual(columns['bad'].dictionary[0].value, 'many')
+
+    def testQueryIter(self):
+        http = LocalHTTPServer(json_responder(self.test_json))
+        try:
+            sparql = SPARQLServer(http.url + '/bigdata/sparql')
+            for i in range(2):
+                with sparql.query_iter('SELECT * WHERE { ?s ?p ?o }') as results:
+                    self.assertEqual(results.vars[0], 'product')
+                    self.assertEqual(len(list(results)), 3)
+            self.assertEqual(len(set(r[4] for r in http.requests)), 1)
+        finally:
+            http.stop()
+
+    def testMalformedResponse(self):
+        http = LocalHTTPServer(json_responder('{"head": {"vars": ['))
+        try:
+            sparql = SPARQLServer(http.url + '/sparql',
+                                  pool=ConnectionPool(max_size=1, wait=1))
+            for i in range(2):
+                self.assertRaises(ValueError, sparql.query_iter, 'ASK {}')
+        finally:
+            http.stop()
+
+class TestAsyncSPARQLServer(unittest.TestCase):
+    test_json = TestConnectionPool.test_json
+
+    def setUp(self):
+        self.http = LocalHTTPServer(self.respond)
+        self.sparql = AsyncSPARQLServer(self.http.url + '/bigdata/sparql',
+                                        max_concurrency=4)
+
+    def tearDown(self):
+        self.sparql.close()
+        self.http.stop()
+
+    def respond(self, handler):
+        if 'fail' in handler.path:
+            return 500, {}, 'Oops'
+        return 200, {'Content-Type': 'application/sparql-results+json'}, \
+            self.test_json
+
+    def testConcurrentQueries(self):
+        futures = [self.sparql.query('SELECT * WHERE { ?s ?p %d }' % i)
+                   for i in range(20)]
+        for future in futures:
+            results = future.result(5)
+            self.assertEqual(results['head']['vars'], ['s'])
+        self.assertEqual(len(self.http.requests), 20)
+        self.assertTrue(len(set(r[4] for r in self.http.requests)) <= 4)
+
+    def testQueryIter(self):
+        results = self.sparql.query_iter('SELECT * WHERE { ?s ?p ?o }').result(5)
+        self.assertEqual(results.vars, ['s'])
+        self.assertEqual(len(list(results)), 1)
+
+    def testUnclosedResults(self):
+        """Streamed results left open don't starve later queries."""
+        sparql = AsyncSPARQLServer(self.http.url + '/bigdata/sparql',
+                                   max_concurrency=2)
+        try:
+            streams = [sparql.query_iter('SELECT * WHERE { ?s ?p ?o }')
+                       .result(5) for i in range(2)]
+            results = sparql.query('SELECT * WHERE { ?s ?p ?o }').result(5)
+            self.assertEqual(results['head']['vars'], ['s'])
+            for stream in streams:
+                stream.close()
+        finally:
+            sparql.close()
+
+    def testError(self):
+        future = self.sparql.query('SELECT * WHERE { ?s ?p "fail" }')
+        self.assertTrue(isinstance(future.exception(5), SPARQLQueryException))
+        self.assertRaises(SPARQLQueryException, future.result)
+
+    def testCallback(self):
+        done = threading.Event()
+        self.sparql.query('ASK {}').add_done_callback(lambda f: done.set())
+        self.assertTrue(done.wait(5))
+
+    def testCallbacksRunBeforeResult(self):
+        """Callbacks, which may read the result themselves, have all run by
+        the time other threads get it."""
+        go = threading.Event()
+        seen = []
+        def callback(future):
+            time.sleep(0.3)
+            seen.append(future.result())
+        workers = WorkerPool(1)
+        try:
+            future = workers.submit(lambda: go.wait(5) and 'result')
+            future.add_done_callback(callback)
+            go.set()
+            time.sleep(0.1)
+            self.assertEqual(future.result(5), 'result')
+            self.assertEqual(seen, ['result'])
+        finally:
+            workers.shutdown()
+
+class TestInsert(unittest.TestCase):
+    def setUp(self):
+        self.http = LocalHTTPServer(lambda handler: (
+            200, {'Content-Type': 'application/xml'},
+            '<?xml version="1.0"?><data modified="%d" milliseconds="3"/>' %
+            self.http.requests[-1][3].count('\n')))
+        self.sparql = SPARQLServer(self.http.url + '/bigdata/sparql')
+
+    def tearDown(self):
+        self.http.stop()
+
+    def testInsertQuads(self):
+        dataset = Dataset()
+        for i in range(100):
+            dataset.add(Quad(NamedNode('http://example.com/s%d' % i),
+                             NamedNode('http://example.com/p'),
+                             Literal(u'caf\u00e9 %d' % i, 'fr'),
+                             NamedNode('http://example.com/g')))
+        self.assertEqual(self.sparql.insert(dataset, chunk_size=256), 100)
+        method, path, headers, body, client = self.http.requests[0]
+        self.assertEqual(method, 'POST')
+        self.assertEqual(headers['content-type'], 'text/x-nquads')
+        self.assertEqual(headers['transfer-encoding'], 'chunked')
+        parsed = nquads_parser.parse(StringIO(body))
+        self.assertEqual(set(parsed), set(dataset))
+
+    def testInsertTriples(self):
+        triples = (Triple(NamedNode('http://example.com/s'),
+                          NamedNode('http://example.com/p'),
+                          Literal(str(i))) for i in range(10))
+        self.assertEqual(self.sparql.insert(
+            triples, format='ntriples',
+            context_uri='http://example.com/g'), 10)
+        method, path, headers, body, client = self.http.requests[0]
+        self.assertEqual(headers['content-type'], 'text/plain')
+        self.assertTrue('context-uri=http%3A%2F%2Fexample.com%2Fg' in path)
+
+class TestBulkLoad(unittest.TestCase):
+    nquads = ''.join('<http://example.com/s%d> <http://example.com/p> '
+                     '"%d" <http://example.com/g> .\n' % (i, i)
+                     for i in range(1000))
+
+    def setUp(self):
+        self.failures = 0
+        self.http = LocalHTTPServer(self.respond)
+        self.sparql = SPARQLServer(self.http.url + '/bigdata/sparql',
+                                   pool=ConnectionPool(max_size=4))
+
+    def tearDown(self):
+        self.http.stop()
+
+    def respond(self, handler):
+        body = self.http.requests[-1][3]
+        if 'INVALID' in body:
+            return 400, {}, 'Syntax error'
+        if 's500>' in body and self.failures < 2:
+            self.failures += 1
+            return 503, {}, 'Busy'
+        return 200, {'Content-Type': 'application/xml'}, \
+            '<data modified="%d" milliseconds="1"/>' % body.count('\n')
+
+    def testLoad(self):
+        progress = []
+        report = self.sparql.bulk_load(StringIO(self.nquads), progress.append,
+                                       workers=4, batch_size=4096,
+                                       retry_delay=0)
+        self.assertEqual(report.statements, 1000)
+        self.assertEqual(report.modified, 1000)
+        self.assertEqual(len(report.batches), len(self.http.requests) - 2)
+        self.assertEqual([b.index for b in report.batches],
+                         range(len(report.batches)))
+        self.assertEqual(max(b.attempts for b in report.batches), 3)
+        self.assertEqual(len(progress), len(report.batches))
+        received = ''.join(r[3] for r in self.http.requests)
+        self.assertEqual(set(received.splitlines()),
+                         set(self.nquads.splitlines()))
+
+    def testFailedBatch(self):
+        loader = BulkLoader(self.sparql, batch_size=4096, max_attempts=2,
+                            retry_delay=0)
+        try:
+            loader.load(StringIO(self.nquads))
+        except BulkLoadException as e:
+            self.assertEqual(len(e.report.failed), 1)
+            self.assertEqual(e.report.failed[0].attempts, 2)
+            self.assertEqual(dict(loader.retry.retries), {'503': 1})
+            self.assertEqual(loader.retry.exhausted, 1)
+            self.assertTrue(isinstance(e.report.failed[0].error,
+                                       SPARQLQueryException))
+        else:
+            self.fail('Expected BulkLoadException')
+
+    def testRejectedBatch(self):
+        """Batches the store rejects aren't retried."""
+        loader = BulkLoader(self.sparql, retry_delay=0)
+        try:
+            loader.load(StringIO('INVALID\n'))
+        except BulkLoadException as e:
+            self.assertEqual(e.report.failed[0].attempts, 1)
+            self.assertEqual(e.report.failed[0].error.status, 400)
+        else:
+            self.fail('Expected BulkLoadException')
+        self.assertEqual(len(self.http.requests), 1)
+
+    def testLoadStatements(self):
+        statements = (Quad(NamedNode('http://example.com/s'),
+                           NamedNode('http://example.com/p'), Literal(str(i)),
+                           NamedNode('http://example.com/g'))
+                      for i in range(100))
+        report = BulkLoader(self.sparql, batch_size=1024).load(statements)
+        self.assertEqual(report.modified, 100)
+        self.assertTrue(len(report.batches) > 1)
+
+class TestAccessPaths(unittest.TestCase):
+    def setUp(self):
+        self.http = LocalHTTPServer(self.respond)
+        self.sparql = SPARQLServer(self.http.url + '/bigdata/sparql')
+
+    def tearDown(self):
+        self.http.stop()
+
+    def respond(self, handler):
+        if handler.path.startswith('/bigdata/sparql?ESTCARD'):
+            return 200, {'Content-Type': 'application/xml'}, \
+                '<?xml version="1.0"?><data rangeCount="42" milliseconds="0"/>'
+        if handler.path.startswith('/bigdata/sparql?HASSTMT'):
+            return 200, {'Content-Type': 'application/xml'}, \
+                '<data result="%s" milliseconds="0"/>' % \
+                ('true' if 'yes' in handler.path else 'false')
+        if handler.path.startswith('/bigdata/sparql?GETSTMTS'):
+            return 200, {'Content-Type': handler.headers['accept']}, \
+                ''.join(TestBulkLoad.nquads.splitlines(True)[:20])
+        if handler.command == 'DELETE':
+            return 200, {'Content-Type': 'application/xml'}, \
+                '<data modified="%d" milliseconds="0"/>' % len(handler.path)
+        return 400, {}, 'Bad request'
+
+    def params(self, request):
+        return urlparse.parse_qs(urlparse.urlsplit(request[1]).query,
+                                 keep_blank_values=True)
+
+    def testEstimateCardinality(self):
+        self.assertEqual(self.sparql.estimate_cardinality(
+            p=NamedNode('http://example.com/p'),
+            o=Literal('1', datatype=NamedNode(XSD_INTEGER))), 42)
+        self.assertEqual(self.params(self.http.requests[0]), {
+            'ESTCARD': [''], 'p': ['<http://example.com/p>'],
+            'o': ['"1"^^<%s>' % XSD_INTEGER]})
+        self.assertEqual(self.sparql.estimate_cardinality(
+            c='http://example.com/g', exact=True), 42)
+        self.assertEqual(self.params(self.http.requests[1]), {
+            'ESTCARD': [''], 'c': ['<http://example.com/g>'],
+            'exact': ['true']})
+
+    def testHasStatement(self):
+        self.assertTrue(self.sparql.has_statement(
+            'http://example.com/yes', 'http://example.com/p'))
+        self.assertFalse(self.sparql.has_statement(
+            'http://example.com/no', include_inferred=False))
+        self.assertEqual(self.params(self.http.requests[1]), {
+            'HASSTMT': [''], 's': ['<http://example.com/no>'],
+            'includeInferred': ['false']})
+
+    def testHasStatements(self):
+        triples = [Triple(NamedNode('http://example.com/%s%d' % (answer, i)),
+                          NamedNode('http://example.com/p'), Literal('o'))
+                   for i, answer in enumerate(['yes', 'no'] * 10)]
+        self.assertEqual(self.sparql.has_statements(triples, workers=4),
+                         [True, False] * 10)
+
+    def testGetStatements(self):
+        dataset = self.sparql.get_statements(p='http://example.com/p')
+        self.assertEqual(len(dataset), 20)
+        self.assertEqual(self.params(self.http.requests[0]), {
+            'GETSTMTS': [''], 'p': ['<http://example.com/p>'],
+            'includeInferred': ['true']})
+        self.assertEqual(self.http.requests[0][2]['accept'], 'text/x-nquads')
+        quads = []
+        self.sparql.get_statements(sink=quads.append)
+        self.assertEqual(set(quads), set(dataset))
+        # The connection was read to the end and reused.
+        self.assertEqual(len(set(r[4] for r in self.http.requests)), 1)
+
+    def testDeleteMatching(self):
+        deleted = self.sparql.delete_matching(s='http://example.com/s',
+                                              c='http://example.com/g')
+        method, path = self.http.requests[0][:2]
+        self.assertEqual(method, 'DELETE')
+        self.assertEqual(deleted, len(path))
+        self.assertEqual(self.params(self.http.requests[0]), {
+            's': ['<http://example.com/s>'], 'c': ['<http://example.com/g>']})
+        self.assertRaises(ValueError, self.sparql.delete_matching)
+
+    def testDeleteMatchingMany(self):
+        patterns = [('http://example.com/s%d' % i, None, Literal('x' * i))
+                    for i in range(10)] + [{'p': 'http://example.com/p'}]
+        deleted = self.sparql.delete_matching_many(patterns, workers=3)
+        self.assertEqual(len(deleted), 11)
+        self.assertEqual(deleted, sorted(deleted[:10]) + deleted[10:])
+        self.assertEqual(len(self.http.requests), 11)
+
+class TestTransactions(unittest.TestCase):
+    def setUp(self):
+        self.http = LocalHTTPServer(self.respond)
+        self.sparql = SPARQLServer(self.http.url +
+                                   '/bigdata/namespace/kb/sparql')
+
+    def tearDown(self):
+        self.http.stop()
+
+    def respond(self, handler):
+        tx = '<tx txId="-7" readsOnCommitTime="1000" readOnly="false"/>'
+        if handler.path.startswith('/bigdata/tx/-7?PREPARE'):
+            return 409, {}, 'Conflict'
+        if handler.path.startswith('/bigdata/tx'):
+            return 200, {'Content-Type': 'application/xml'}, \
+                '<?xml version="1.0"?><response>%s</response>' % tx
+        if handler.path.startswith('/bigdata/namespace/kb/sparql'):
+            return 200, {'Content-Type': 'application/xml'}, \
+                '<data modified="1" milliseconds="0"/>'
+        return 400, {}, 'Bad request'
+
+    def paths(self):
+        return [request[0] + ' ' + request[1] for request in self.http.requests]
+
+    def testCommit(self):
+        with self.sparql.transaction() as tx:
+            self.assertTrue(isinstance(tx, Transaction))
+            self.assertEqual(tx.tx_id, '-7')
+            tx.update('INSERT DATA { <a:s> <a:p> <a:o> }')
+            tx.insert([Triple(NamedNode('http://example.com/s'),
+                              NamedNode('http://example.com/p'),
+                              Literal('o'))])
+        self.assertEqual(tx.state, 'committed')
+        paths = self.paths()
+        self.assertEqual(paths[0], 'POST /bigdata/tx')
+        self.assertEqual(paths[-1], 'POST /bigdata/tx/-7?COMMIT')
+        self.assertEqual(urlparse.parse_qs(self.http.requests[1][3])['timestamp'],
+                         ['-7'])
+        self.assertTrue('timestamp=-7' in paths[2])
+        # The server itself isn't tied to the transaction.
+        self.sparql.update('CLEAR ALL')
+        self.assertFalse('timestamp' in self.http.requests[-1][3])
+
+    def testAbort(self):
+        def fail():
+            with self.sparql.transaction(timestamp=1000) as tx:
+                raise ValueError()
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(self.paths(), ['POST /bigdata/tx?timestamp=1000',
+                                        'POST /bigdata/tx/-7?ABORT'])
+
+    def testStatus(self):
+        tx = self.sparql.transaction()
+        self.assertEqual(tx.status(), {'txId': '-7', 'readOnly': 'false',
+                                       'readsOnCommitTime': '1000'})
+        self.assertFalse(tx.prepare())
+        self.assertEqual([t['txId'] for t in self.sparql.transactions()],
+                         ['-7'])
+        self.assertEqual(self.paths()[-1], 'GET /bigdata/tx')
+
+class TestNamespaceManager(unittest.TestCase):
+    def setUp(self):
+        self.http = LocalHTTPServer(self.respond)
+        self.manager = NamespaceManager(self.http.url + '/bigdata')
+
+    def tearDown(self):
+        self.http.stop()
+
+    def respond(self, handler):
+        if handler.path == '/bigdata/namespace' and handler.command == 'GET':
+            return 200, {'Content-Type': 'text/plain'}, ''.join(
+                '<%s/bigdata/namespace/%s/sparql> '
+                '<http://www.bigdata.com/rdf#/features/KB/Namespace> '
+                '"%s" .\n' % (self.http.url, name, name)
+                for name in ('kb', 'tenant'))
+        if handler.path == '/bigdata/namespace/kb/properties':
+            return 200, {'Content-Type': 'application/xml'}, \
+                '<properties><entry key="com.bigdata.rdf.sail.namespace">kb' \
+                '</entry></properties>'
+        if handler.command in ('POST', 'DELETE'):
+            return 201 if handler.command == 'POST' else 200, {}, ''
+        return 400, {}, 'Bad request'
+
+    def testNamespaces(self):
+        self.assertEqual(self.manager.namespaces(), ['kb', 'tenant'])
+        self.assertTrue('tenant' in self.manager)
+        self.assertEqual(self.manager.properties('kb'),
+                         {'com.bigdata.rdf.sail.namespace': 'kb'})
+
+    def testCreateAndDestroy(self):
+        server = self.manager.create('a b', {
+            'com.bigdata.rdf.store.AbstractTripleStore.quads': True})
+        command, path, headers, body = self.http.requests[0][:4]
+        self.assertEqual((command, path), ('POST', '/bigdata/namespace'))
+        self.assertEqual(body.splitlines(), [
+            'com.bigdata.rdf.sail.namespace=a b',
+            'com.bigdata.rdf.store.AbstractTripleStore.quads=True'])
+        self.assertEqual(server.query_url,
+                         self.http.url + '/bigdata/namespace/a%20b/sparql')
+        self.assertEqual(server.service_url, self.http.url + '/bigdata')
+        self.manager.destroy('a b')
+        self.assertEqual(self.http.requests[1][:2],
+                         ('DELETE', '/bigdata/namespace/a%20b'))
+        self.assertTrue(self.manager.server('a b') is not server)
+
+    def testServersAreShared(self):
+        kb = self.manager.server('kb')
+        self.assertTrue(self.manager['kb'] is kb)
+        self.assertTrue(self.manager.server('tenant').pool is kb.pool)
+        self.assertTrue(kb.pool is self.manager.pool)
+
+class TestCancellation(unittest.TestCase):
+    results = simplejson.dumps({'head': {'vars': ['s']}, 'results': {
+        'bindings': [{'s': {'type': 'uri', 'value': 'http://example.com/s'}}]}})
+
+    def setUp(self):
+        self.cancelled = threading.Event()
+        self.http = LocalHTTPServer(self.respond)
+        self.sparql = SPARQLServer(self.http.url + '/bigdata/sparql')
+
+    def tearDown(self):
+        self.cancelled.set()
+        self.http.stop()
+
+    def respond(self, handler):
+        params = urlparse.parse_qs(urlparse.urlsplit(handler.path).query,
+                                   keep_blank_values=True)
+        if 'cancelQuery' in params:
+            self.cancelled.set()
+            return 200, {}, ''
+        if 'slow' in params['query'][0]:
+            self.cancelled.wait(5)
+        return 200, {'Content-Type': 'application/sparql-results+json'}, \
+            self.results
+
+    def params(self, request):
+        return urlparse.parse_qs(urlparse.urlsplit(request[1]).query,
+                                 keep_blank_values=True)
+
+    def testQueryId(self):
+        self.sparql.query('SELECT * { ?s ?p ?o }', query_id='q1')
+        self.assertEqual(self.params(self.http.requests[0])['queryId'], ['q1'])
+        with self.sparql.query_iter('SELECT * { ?s ?p ?o }') as results:
+            self.assertEqual(self.params(self.http.requests[1])['queryId'],
+                             [results.query_id])
+        self.sparql.cancel(results.query_id)
+        self.assertEqual(self.params(self.http.requests[2]), {
+            'cancelQuery': [''], 'queryId': [results.query_id]})
+
+    def testDeadline(self):
+        start = time.time()
+        self.assertRaises(DeadlineExceededException, self.sparql.query,
+                          'SELECT * { ?slow ?p ?o }', query_id='q2',
+                          deadline=0.2)
+        self.assertTrue(time.time() - start < 2)
+        self.assertTrue(self.cancelled.wait(2))
+        self.assertEqual(self.params(self.http.requests[-1])['queryId'],
+                         ['q2'])
+        # The abandoned connection isn't handed out again.
+        self.assertEqual(self.sparql.query('SELECT * { ?s ?p ?o }',
+                                           deadline=5)['results']['bindings'],
+                         simplejson.loads(self.results)['results']['bindings'])
+        self.assertEqual(len(self.http.requests), 3)
+        self.assertNotEqual(self.http.requests[2][4], self.http.requests[0][4])
+
+    def testDeadlineConnecting(self):
+        """A connect that hangs is bounded by the deadline."""
+        class HangingConnection(httplib.HTTPConnection):
+            def connect(self):
+                time.sleep(self.timeout if self.timeout is not None else 10)
+                raise socket.timeout('timed out')
+        pool = ConnectionPool()
+        pool.connection_classes = dict(pool.connection_classes,
+                                       http=HangingConnection)
+        sparql = SPARQLServer(self.http.url + '/bigdata/sparql', pool=pool,
+                              retry=RetryPolicy(max_attempts=1))
+        start = time.time()
+        self.assertRaises(DeadlineExceededException, sparql.query,
+                          'SELECT * { ?s ?p ?o }', deadline=0.2)
+        self.assertTrue(time.time() - start < 2)
+
+class TestStatus(unittest.TestCase):
+    page = """<html><body>
+<p>Accepted query count=%d</p><p>Running query count=1</p>
+<p>Show <a href="?showQueries">queries</a></p>
+<pre>/queryStartCount=%d
+/operatorActiveCount=2
+/GeoSpatial/mode=off
+</pre>
+<h1>Running Queries</h1>
+<h2>solutions=10, chunks=1, elapsed=%dms, deadline=NA, isCancelled=false,
+queryId=6c0e5bb0-2b33-4d4c-95d5-b0a1f1e4d8b2</h2>
+<pre>SELECT * { ?s ?p ?o }</pre>
+</body></html>"""
+
+    def setUp(self):
+        self.polls = 0
+        self.http = LocalHTTPServer(self.respond)
+        self.sparql = SPARQLServer(self.http.url + '/bigdata/sparql')
+
+    def tearDown(self):
+        self.http.stop()
+
+    def respond(self, handler):
+        self.polls += 1
+        return 200, {'Content-Type': 'text/html'}, \
+            self.page % (10 * self.polls, 5 * self.polls, 100 * self.polls)
+
+    def testStatus(self):
+        status = self.sparql.status(queries=True)
+        self.assertTrue(isinstance(status, ServerStatus))
+        self.assertEqual(self.http.requests[0][1],
+                         '/bigdata/status?showQueries=')
+        self.assertEqual(status.counters, {
+            'Accepted query count': 10, 'Running query count': 1,
+            '/queryStartCount': 5, '/operatorActiveCount': 2,
+            '/GeoSpatial/mode': 'off'})
+        query, = status.queries
+        self.assertEqual(query.query_id, '6c0e5bb0-2b33-4d4c-95d5-b0a1f1e4d8b2')
+        self.assertEqual(query.elapsed, 100)
+        self.assertEqual(query.sparql, 'SELECT * { ?s ?p ?o }')
+        self.assertEqual(query.details['solutions'], 10)
+        self.assertEqual(query.details['isCancelled'], 'false')
+
+    def testPollStatus(self):
+        polls = list(self.sparql.poll_status(interval=0.01, count=3))
+        self.assertEqual(len(polls), 3)
+        self.assertEqual(polls[0][1], None)
+        delta = polls[2][1]
+        self.assertTrue(delta.pop('seconds') >= 0.01)
+        self.assertEqual(delta, {'Accepted query count': 10,
+                                 'Running query count': 0,
+                                 '/queryStartCount': 5,
+                                 '/operatorActiveCount': 0})
+        self.assertEqual(self.http.requests[0][1], '/bigdata/status')
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.http = LocalHTTPServer(self.respond)
+        self.cache = ResultCache()
+        self.kb = SPARQLServer(self.http.url + '/bigdata/namespace/kb/sparql',
+                               cache=self.cache)
+        self.other = SPARQLServer(
+            self.http.url + '/bigdata/namespace/other/sparql', cache=self.cache)
+
+    def tearDown(self):
+        self.http.stop()
+
+    def respond(self, handler):
+        if handler.path.startswith('/bigdata/tx'):
+            return 200, {'Content-Type': 'application/xml'}, \
+                '<response><tx txId="-7" readOnly="false"/></response>'
+        if handler.command != 'GET':
+            return 200, {'Content-Type': 'application/xml'}, \
+                '<data modified="1" milliseconds="0"/>'
+        return 200, {'Content-Type': 'application/sparql-results+json'}, \
+            TestCancellation.results
+
+    def queries(self):
+        return len([request for request in self.http.requests
+                    if request[0] == 'GET'])
+
+    def testHitsAndMisses(self):
+        results = self.kb.query('SELECT * { ?s ?p "a  b" }')
+        self.assertEqual(self.kb.query('SELECT *\n# any\n{ ?s ?p "a  b" }'),
+                         results)
+        self.assertEqual(len(self.http.requests), 1)
+        self.kb.query('SELECT * { ?s ?p "a b" }')
+        self.kb.query('SELECT * { ?s ?p "a  b" }', output='xml')
+        self.kb.query('SELECT * { ?s ?p "a  b" }', default_graph='a:g')
+        self.kb.query('SELECT * { ?s ?p "a  b" }', cache=False)
+        self.other.query('SELECT * { ?s ?p "a  b" }')
+        self.assertEqual(len(self.http.requests), 6)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 5))
+        self.assertEqual(len(self.cache), 5)
+
+    def testInvalidation(self):
+        self.kb.query('SELECT * { ?s ?p ?o }')
+        self.other.query('SELECT * { ?s ?p ?o }')
+        self.kb.update('CLEAR ALL')
+        self.other.query('SELECT * { ?s ?p ?o }')
+        self.kb.query('SELECT * { ?s ?p ?o }')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 3))
+        self.cache.invalidate_all = True
+        self.kb.delete_matching(s='http://example.com/s')
+        self.assertEqual(len(self.cache), 0)
+
+    def testTransactionCommit(self):
+        self.kb.query('SELECT * { ?s ?p ?o }')
+        with self.kb.transaction() as tx:
+            tx.update('INSERT DATA { <a:s> <a:p> <a:o> }')
+            # Read before the commit, and cached.
+            self.kb.query('SELECT * { ?s ?p ?o }')
+        self.kb.query('SELECT * { ?s ?p ?o }')
+        self.assertEqual(self.queries(), 3)
+
+    def testGraphStore(self):
+        store = UpdateableGraphStore(
+            self.http.url + '/bigdata/namespace/kb/sparql',
+            self.http.url + '/bigdata/namespace/kb/sparql', cache=self.cache)
+        for change in (lambda: store.put('http://example.com/g',
+                                         rdflib.Graph()),
+                       lambda: store.post('http://example.com/g',
+                                          rdflib.Graph()),
+                       lambda: store.delete('http://example.com/g')):
+            store.query('SELECT * { ?s ?p ?o }')
+            change()
+        store.query('SELECT * { ?s ?p ?o }')
+        self.assertEqual(self.queries(), 4)
+
+    def testLimits(self):
+        size = len(TestCancellation.results)
+        self.cache.max_entries = 3
+        self.cache.max_bytes = size * 2
+        for i in range(3):
+            self.kb.query('SELECT * { ?s ?p %d }' % i)
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.bytes, size * 2)
+        self.assertEqual(self.cache.evictions, 1)
+        self.kb.query('SELECT * { ?s ?p 1 }')
+        self.assertEqual(self.cache.hits, 1)
+        self.cache.ttl = 0
+        self.kb.query('SELECT * { ?s ?p 3 }')
+        self.kb.query('SELECT * { ?s ?p 3 }')
+        self.assertEqual(self.cache.expirations, 1)
+        self.assertEqual(len(self.http.requests), 5)
+
+    def testHistoricalReads(self):
+        self.cache.ttl = 0
+        snapshot = self.kb.at(pytz.timezone('CET').localize(
+            datetime.datetime(2015, 1, 1, 1)))
+        self.assertEqual(snapshot.timestamp, 1420070400000)
+        self.assertTrue(snapshot.pool is self.kb.pool)
+        snapshot.query('SELECT * { ?s ?p ?o }')
+        self.kb.update('CLEAR ALL')
+        self.kb.query('SELECT * { ?s ?p ?o }')
+        snapshot.query('SELECT * { ?s ?p ?o }')
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(len(self.http.requests), 3)
+        params = urlparse.parse_qs(urlparse.urlsplit(
+            self.http.requests[0][1]).query)
+        self.assertEqual(params['timestamp'], ['1420070400000'])
+        self.assertFalse('timestamp' in self.http.requests[2][1])
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+        other = ResultCache()
+        self.assertTrue(self.kb.at(1420070400000, cache=other).cache is other)
+
+class TestRetry(unittest.TestCase):
+    def setUp(self):
+        self.failures = []
+        self.http = LocalHTTPServer(self.respond)
+        self.retry = RetryPolicy(backoff=0.01)
+        self.sparql = SPARQLServer(self.http.url + '/bigdata/sparql',
+                                   retry=self.retry)
+
+    def tearDown(self):
+        self.http.stop()
+
+    def respond(self, handler):
+        if self.failures:
+            failure = self.failures.pop(0)
+            if failure == 'reset':
+                handler.connection.shutdown(socket.SHUT_RDWR)
+                raise socket.error('reset')
+            return failure, {}, 'Unavailable'
+        if 'ESTCARD' in handler.path:
+            return 200, {'Content-Type': 'application/xml'}, \
+                '<data rangeCount="5" milliseconds="0"/>'
+        if handler.command == 'POST':
+            return 200, {'Content-Type': 'application/xml'}, \
+                '<data modified="1" milliseconds="0"/>'
+        return 200, {'Content-Type': 'application/sparql-results+json'}, \
+            TestCancellation.results
+
+    def testQuery(self):
+        self.failures = [503]
+        self.assertEqual(self.sparql.query('ASK {}')['head']['vars'], ['s'])
+        # The pool itself retries a reused connection that was reset once,
+        # and the second reset is on a new one.
+        self.failures = ['reset', 'reset']
+        with self.sparql.query_iter('ASK {}') as results:
+            self.assertEqual(results.vars, ['s'])
+        self.assertEqual(dict(self.retry.retries),
+                         {'503': 1, 'BadStatusLine': 1})
+
+    def testGiveUp(self):
+        self.failures = [503, 502, 500]
+        self.assertRaises(SPARQLQueryException, self.sparql.query, 'ASK {}')
+        self.assertEqual(len(self.http.requests), 3)
+        self.assertEqual(self.retry.exhausted, 1)
+        self.failures = [400]
+        self.assertRaises(SPARQLQueryException, self.sparql.query, 'ASK {}')
+        self.assertEqual(len(self.http.requests), 4)
+
+    def testUpdate(self):
+        self.failures = [503]
+        self.assertRaises(SPARQLQueryException, self.sparql.update,
+                          'INSERT DATA { <a:s> <a:p> 1 }')
+        self.failures = [503]
+        self.sparql.update('CLEAR ALL', idempotent=True)
+        self.assertEqual(len(self.http.requests), 3)
+        self.assertEqual(sum(self.retry.retries.values()), 1)
+
+    def testDeadline(self):
+        """Retries share the request's deadline rather than each starting
+        a new one, and don't wait past it."""
+        def respond(handler):
+            time.sleep(0.4)
+            return 503, {}, 'Unavailable'
+        self.http.responder = respond
+        for backoff in (0.01, 1):
+            sparql = SPARQLServer(self.http.url + '/bigdata/sparql',
+                                  retry=RetryPolicy(backoff=backoff,
+                                                    jitter=0))
+            start = time.time()
+            self.assertRaises(DeadlineExceededException, sparql.query,
+                              'ASK {}', deadline=0.5)
+            self.assertTrue(time.time() - start < 0.8)
+
+    def testAccessPath(self):
+        self.failures = [503]
+        self.assertEqual(self.sparql.estimate_cardinality(), 5)
+        self.assertEqual(dict(self.retry.retries), {'503': 1})
+
+    def testDelay(self):
+        retry = RetryPolicy(backoff=1, max_backoff=3, jitter=0.5)
+        for attempt, delay in [(1, 1), (2, 2), (3, 3), (10, 3)]:
+            self.assertTrue(delay / 2.0 <= retry.delay(attempt) <= delay)
+
+class TestCluster(unittest.TestCase):
+    def setUp(self):
+        self.down = set()
+        self.busy = 0
+        self.replicas = [LocalHTTPServer(self.respond) for i in range(3)]
+        self.cluster = ClusterSPARQLServer(
+            [replica.url + '/bigdata/sparql' for replica in self.replicas],
+            health_interval=None)
+
+    def tearDown(self):
+        self.cluster.close()
+        for replica in self.replicas:
+            replica.stop()
+
+    def respond(self, handler):
+        if handler.server in self.down:
+            return 503, {}, 'Unavailable'
+        if handler.command == 'POST':
+            if self.busy:
+                self.busy -= 1
+                return 503, {}, 'Paused for GC'
+            return 200, {'Content-Type': 'application/xml'}, \
+                '<data modified="1" milliseconds="0"/>'
+        if 'INVALID' in handler.path:
+            return 400, {}, 'Bad request'
+        return 200, {'Content-Type': 'application/sparql-results+json'}, \
+            TestCancellation.results
+
+    def counts(self):
+        return [len(replica.requests) for replica in self.replicas]
+
+    def testRoundRobin(self):
+        for i in range(6):
+            self.cluster.query('ASK {}')
+        self.assertEqual(self.counts(), [2, 2, 2])
+        self.cluster.update('CLEAR ALL')
+        self.cluster.insert([Triple(NamedNode('http://example.com/s'),
+                                    NamedNode('http://example.com/p'),
+                                    Literal('o'))])
+        self.assertEqual(self.counts(), [4, 2, 2])
+
+    def testFailover(self):
+        self.down.add(self.replicas[1])
+        for i in range(6):
+            self.cluster.query('ASK {}')
+        self.assertFalse(self.cluster.nodes[1].healthy)
+        self.assertEqual(self.cluster.nodes[1].failures, 1)
+        self.assertEqual(self.counts(), [3, 1, 3])
+        self.assertEqual(self.cluster.nodes[1].server.retry.max_attempts, 1)
+        # Query errors aren't the endpoint's fault.
+        self.assertRaises(SPARQLQueryException, self.cluster.query, 'INVALID')
+        self.assertTrue(self.cluster.nodes[0].healthy)
+        self.down.clear()
+        self.cluster.check_health()
+        self.assertTrue(self.cluster.nodes[1].healthy)
+        self.assertEqual(self.replicas[1].requests[-1][1], '/bigdata/status')
+
+    def testLeaderRetry(self):
+        """Writes, which have no failover, are still retried."""
+        self.cluster.leader.retry.backoff = 0.01
+        self.busy = 1
+        self.cluster.update('CLEAR ALL', idempotent=True)
+        self.assertEqual(self.counts(), [2, 0, 0])
+        self.assertEqual(dict(self.cluster.leader.retry.retries), {'503': 1})
+
+    def testCache(self):
+        """A write invalidates the results cached from every replica."""
+        cache = ResultCache()
+        cluster = ClusterSPARQLServer(
+            [replica.url + '/bigdata/sparql' for replica in self.replicas],
+            health_interval=None, cache=cache)
+        try:
+            for i in range(3):
+                cluster.query('ASK {}')
+            self.assertEqual(len(cache), 3)
+            cluster.update('CLEAR ALL')
+            self.assertEqual(len(cache), 0)
+        finally:
+            cluster.close()
+
+    def testAllDown(self):
+        self.down.update(self.replicas)
+        self.assertRaises(SPARQLQueryException, self.cluster.query, 'ASK {}')
+        self.assertEqual(self.counts(), [1, 1, 1])
+        self.down.clear()
+        # With nothing healthy, ejected endpoints are still tried.
+        self.cluster.query('ASK {}')
+
+    def testLeastLoaded(self):
+        self.cluster.strategy = 'least_loaded'
+        self.cluster.nodes[0].in_flight = 5
+        self.cluster.nodes[2].in_flight = 1
+        for i in range(3):
+            self.cluster.query('ASK {}')
+        self.assertEqual(self.counts(), [0, 3, 0])
+
+class TestPagination(unittest.TestCase):
+    rows = ['http://example.com/s%02d' % i for i in range(25)]
+
+    def setUp(self):
+        self.http = LocalHTTPServer(self.respond)
+        self.sparql = SPARQLServer(self.http.url + '/bigdata/sparql')
+
+    def tearDown(self):
+        self.http.stop()
+
+    def respond(self, handler):
+        query = urlparse.parse_qs(urlparse.urlsplit(handler.path).query)[
+            'query'][0]
+        rows = self.rows
+        after = re.search(r'STR\(\?s\) > "([^"]*)"', query)
+        if after:
+            rows = [row for row in rows if row > after.group(1)]
+        offset = re.search(r'OFFSET (\d+)', query)
+        if offset:
+            rows = rows[int(offset.group(1)):]
+        rows = rows[:int(re.search(r'LIMIT (\d+)', query).group(1))]
+        return 200, {'Content-Type': 'application/sparql-results+json'}, \
+            simplejson.dumps({'head': {'vars': ['s']}, 'results': {
+                'bindings': [{'s': {'type': 'uri', 'value': row}}
+                             for row in rows]}})
+
+    def queries(self):
+        return [urlparse.parse_qs(urlparse.urlsplit(request[1]).query)[
+            'query'][0] for request in self.http.requests]
+
+    def testOffset(self):
+        pages = self.sparql.query_pages(
+            'PREFIX ex: <http://example.com/>\n'
+            'SELECT DISTINCT ?s WHERE { ?s ex:p ?o }', page_size=10)
+        self.assertEqual([binding['s']['value'] for binding in pages],
+                         self.rows)
+        self.assertEqual(pages.pages, 3)
+        self.assertEqual(self.queries(), [
+            'PREFIX ex: <http://example.com/> SELECT * WHERE { { SELECT '
+            'DISTINCT ?s WHERE { ?s ex:p ?o } } } ORDER BY ?s LIMIT 10'] + [
+            'PREFIX ex: <http://example.com/> SELECT * WHERE { { SELECT '
+            'DISTINCT ?s WHERE { ?s ex:p ?o } } } ORDER BY ?s LIMIT 10 '
+            'OFFSET %d' % offset for offset in (10, 20)])
+
+    def testKeyset(self):
+        pages = self.sparql.query_pages('SELECT * { ?s ?p ?o }', page_size=5,
+                                        keyset='?s', decode=True)
+        self.assertEqual([row.s for row in pages],
+                         [NamedNode(row) for row in self.rows])
+        queries = self.queries()
+        # A probe for the variables isn't needed, the last page is empty.
+        self.assertEqual(len(queries), 6)
+        self.assertFalse(any('OFFSET' in query for query in queries))
+        self.assertTrue(queries[3].endswith(
+            'FILTER(STR(?s) > "http://example.com/s14") } '
+            'ORDER BY STR(?s) LIMIT 5'))
+
+    def testSelectStar(self):
+        pages = self.sparql.query_pages('SELECT * { ?s ?p ?o }',
+                                        page_size=100, prefetch=False)
+        self.assertEqual(len(list(pages.iter_pages())), 1)
+        self.assertEqual(self.queries(), [
+            'SELECT * WHERE { { SELECT * { ?s ?p ?o } } } LIMIT 0',
+            'SELECT * WHERE { { SELECT * { ?s ?p ?o } } } ORDER BY ?s '
+            'LIMIT 100'])
+        self.assertRaises(ValueError, self.sparql.query_pages, 'ASK {}')
+
+    def testQueryOrder(self):
+        """The query's own ORDER BY orders the pages."""
+        pages = self.sparql.query_pages(
+            'SELECT ?s ?date { ?s <http://example.com/date> ?date } '
+            'ORDER BY DESC(?date)', page_size=10)
+        self.assertEqual(pages.page_query(10),
+                         'SELECT * WHERE { { SELECT ?s ?date { ?s '
+                         '<http://example.com/date> ?date } } } '
+                         'ORDER BY DESC(?date) ?s ?date LIMIT 10 OFFSET 10')
+        self.assertRaises(ValueError, self.sparql.query_pages,
+                          'SELECT ?s { ?s ?p ?o } ORDER BY ?s', keyset='s')
+
+    def testLimit(self):
+        """Queries limiting their own results can't be paged."""
+        self.assertRaises(ValueError, self.sparql.query_pages,
+                          'SELECT ?s { ?s ?p ?o } LIMIT 25')
+        self.assertRaises(ValueError, self.sparql.query_pages,
+                          'SELECT ?s { ?s ?p ?o } ORDER BY ?s OFFSET 5')
+        # A subquery's LIMIT is no concern of the paging query.
+        pages = self.sparql.query_pages(
+            'SELECT ?s { { SELECT ?s { ?s ?p ?o } LIMIT 25 } }')
+        self.assertTrue(pages.page_query().endswith(
+            'LIMIT 25 } } } } ORDER BY ?s LIMIT 10000'))
+
+class TestPreparedQuery(unittest.TestCase):
+    def setUp(self):
+        self.http = LocalHTTPServer(self.respond)
+        self.sparql = SPARQLServer(self.http.url + '/bigdata/sparql')
+
+    def tearDown(self):
+        self.http.stop()
+
+    def respond(self, handler):
+        params = urlparse.parse_qs(urlparse.urlsplit(handler.path).query)
+        return 200, {'Content-Type': 'application/sparql-results+json'}, \
+            simplejson.dumps({'head': {'vars': ['s']}, 'results': {
+                'bindings': [{'s': {'type': 'literal',
+                                    'value': params['$o'][0]}}]}})
+
+    def testPrepare(self):
+        sparql = 'SELECT ?s { ?s <http://example.com/p?x> $o ; ?p "?y" }'
+        prepared = self.sparql.prepare(sparql)
+        self.assertTrue(isinstance(prepared, PreparedQuery))
+        self.assertEqual(prepared.variables, frozenset(['s', 'o', 'p']))
+        self.assertTrue(self.sparql.prepare(sparql).variables is
+                        prepared.variables)
+        self.assertEqual(PreparedQuery.templates.keys()[-1], sparql)
+        self.assertRaises(ValueError, prepared.query, {'x': 'http://a/'})
+
+    def testQuery(self):
+        prepared = self.sparql.prepare('SELECT ?s { ?s ?p ?o }')
+        results = prepared.query({'?o': Literal(u'caf\u00e9', language='fr')})
+        self.assertEqual(results['results']['bindings'][0]['s']['value'],
+                         '"caf\\u00E9"@fr')
+        with prepared.query_iter({'o': 'http://example.com/o'}) as results:
+            self.assertEqual(list(results)[0]['s']['value'],
+                             '<http://example.com/o>')
+        params = urlparse.parse_qs(urlparse.urlsplit(
+            self.http.requests[0][1]).query)
+        self.assertEqual(params['query'], ['SELECT ?s { ?s ?p ?o }'])
+
+    def testQueryMany(self):
+        prepared = self.sparql.prepare('SELECT ?s { ?s ?p ?o }')
+        values = [Literal(str(i), datatype=NamedNode(XSD_INTEGER))
+                  for i in range(20)]
+        results = prepared.query_many([{'o': value} for value in values],
+                                      workers=4)
+        self.assertEqual(
+            [r['results']['bindings'][0]['s']['value'] for r in results],
+            [value.toNT() for value in values])
+
+class TestExplain(unittest.TestCase):
+    page = """<html><body>
+<h1>Query</h1><pre>SELECT * { ?s ?p ?o }</pre>
+<h2>Optimized AST</h2><pre>QueryType: SELECT</pre>
+<h2>Query Evaluation Statistics</h2>
+<table border="1" summary="Query Evaluation Statistics">
+<tr><th>evalOrder</th><th>bopId</th><th>bopSummary</th>
+<th>fastRangeCount</th><th>unitsIn</th><th>unitsOut</th><th>sumMillis</th>
+<th>joinRatio</th></tr>
+<tr><td>total</td><td>-</td><td>total</td><td></td><td>1</td><td>7</td>
+<td>9</td><td>7.0</td></tr>
+<tr><td>0</td><td>3</td><td>PipelineJoin[3]</td><td>40</td><td>1</td>
+<td>40</td><td>3</td><td>40.0</td></tr>
+<tr><td>1</td><td>5</td><td>PipelineJoin[5]</td><td>1000</td><td>40</td>
+<td>7</td><td>6</td><td>0.175</td></tr>
+</table></body></html>"""
+
+    def setUp(self):
+        self.http = LocalHTTPServer(lambda handler: (
+            200, {'Content-Type': 'text/html'}, self.page))
+        self.sparql = SPARQLServer(self.http.url + '/bigdata/sparql')
+
+    def tearDown(self):
+        self.http.stop()
+
+    def params(self, request):
+        return urlparse.parse_qs(urlparse.urlsplit(request[1]).query,
+                                 keep_blank_values=True)
+
+    def testExplain(self):
+        plan = self.sparql.explain('SELECT * { ?s ?p ?o }', details=True)
+        self.assertTrue(isinstance(plan, QueryPlan))
+        self.assertEqual(self.params(self.http.requests[0])['explain'],
+                         ['details'])
+        self.assertEqual(plan.sections['Optimized AST'], 'QueryType: SELECT')
+        self.assertEqual(len(plan.operators), 2)
+        join = plan.operators[1]
+        self.assertEqual((join['bopSummary'], join['fastRangeCount'],
+                          join['unitsIn'], join['unitsOut'],
+                          join['sumMillis'], join['joinRatio']),
+                         ('PipelineJoin[5]', 1000, 40, 7, 6, 0.175))
+        self.assertEqual(plan.total['fastRangeCount'], None)
+        self.assertEqual(plan.millis, 9)
+        self.assertEqual([op['bopId'] for op in plan.slowest(1)], [5])
+
+    def testAnalytic(self):
+        self.sparql.explain('SELECT * { ?s ?p ?o }', analytic=True)
+        self.assertEqual(self.params(self.http.requests[0])['analytic'],
+                         ['true'])
+        self.assertEqual(self.params(self.http.requests[0])['explain'], [''])
+
+class TestCompression(unittest.TestCase):
+    results = simplejson.dumps({'head': {'vars': ['s']}, 'results': {
+        'bindings': [{'s': {'type': 'uri', 'value': 'http://example.com/s'}}]
+        * 1000}})
+
+    def setUp(self):
+        self.http = LocalHTTPServer(self.respond)
+        self.sparql = SPARQLServer(self.http.url + '/bigdata/sparql',
+                                   compress_uploads=9)
+
+    def tearDown(self):
+        self.http.stop()
+
+    def respond(self, handler):
+        if handler.command == 'POST':
+            return 200, {'Content-Type': 'application/xml'}, \
+                '<data modified="1" milliseconds="0"/>'
+        if 'gzip' not in handler.headers.get('accept-encoding', ''):
+            return 200, {'Content-Type': 'application/sparql-results+json'}, \
+                self.results
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return 200, {'Content-Type': 'application/sparql-results+json',
+                     'Content-Encoding': 'gzip'}, \
+            compressor.compress(self.results) + compressor.flush()
+
+    def testResponses(self):
+        counters = self.sparql.pool.counters
+        self.assertEqual(self.sparql.query('SELECT * { ?s ?p ?o }'),
+                         simplejson.loads(self.results))
+        self.assertEqual(counters['bytes_decoded'], len(self.results))
+        self.assertTrue(counters['bytes_received'] < len(self.results) / 10)
+        with self.sparql.query_iter('SELECT * { ?s ?p ?o }') as results:
+            self.assertEqual(len(list(results)), 1000)
+            self.assertEqual(results.f.headers['-content-encoding'], 'gzip')
+        self.assertEqual(counters['bytes_decoded'], 2 * len(self.results))
+        # The connection was read to the end and reused.
+        self.assertEqual(len(set(r[4] for r in self.http.requests)), 1)
+        self.sparql.pool.accept_encoding = None
+        self.sparql.query('SELECT * { ?s ?p ?o }')
+        self.assertEqual(self.http.requests[-1][2]['accept-encoding'],
+                         'identity')
+
+    def testDeflate(self):
+        """Deflate bodies are decoded whether zlib wrapped or raw."""
+        for wbits in (zlib.MAX_WBITS, -zlib.MAX_WBITS):
+            compressor = zlib.compressobj(9, zlib.DEFLATED, wbits)
+            content = compressor.compress(self.results) + compressor.flush()
+            self.http.responder = lambda handler: (
+                200, {'Content-Type': 'application/sparql-results+json',
+                      'Content-Encoding': 'deflate'}, content)
+            self.assertEqual(self.sparql.query('SELECT * { ?s ?p ?o }'),
+                             simplejson.loads(self.results))
+            with self.sparql.query_iter('SELECT * { ?s ?p ?o }') as results:
+                self.assertEqual(len(list(results)), 1000)
+
+    def testUploads(self):
+        quads = [Quad(NamedNode('http://example.com/s%d' % i),
+                      NamedNode('http://example.com/p'), Literal('o'),
+                      NamedNode('http://example.com/g')) for i in range(100)]
+        self.sparql.insert(quads, chunk_size=1000)
+        command, path, headers, body = self.http.requests[0][:4]
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(
+            zlib.decompress(body, 16 + zlib.MAX_WBITS),
+            ''.join('<http://example.com/s%d> <http://example.com/p> "o" '
+                    '<http://example.com/g> .\n' % i for i in range(100)))
+        self.assertEqual(self.sparql.pool.counters['bytes_sent'], len(body))
+
+def test_worker_pool_map():
+    workers = WorkerPool(3)
+    try:
+        assert workers.map(lambda x, y: x * y, range(10), range(10)) == \
+            [x * x for x in range(10)]
+    finally:
+        workers.shutdown()
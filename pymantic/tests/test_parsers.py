@@ -18,6 +18,18 @@ def test_parse_ntriples_named_nodes():
                   NamedNode('http://example.com/predicates/2'),
                   NamedNode('http://example.com/objects/1')) in g
 
+def test_parse_nquads_lines():
+    test_nquads = """<http://example.com/objects/1> <http://example.com/predicates/1> _:a <http://example.com/graph> .
+_:a <http://example.com/predicates/2> "Foo" <http://example.com/graph> .
+"""
+    for i in range(2):
+        quads = []
+        class Sink(object):
+            add = quads.append
+        nquads_parser.parse_lines(StringIO(test_nquads), Sink())
+        assert len(quads) == 2
+        assert quads[0].object is quads[1].subject
+
 def test_parse_ntriples_bare_literals():
     test_ntriples = """<http://example.com/objects/1> <http://example.com/predicates/1> "Foo" .
 <http://example.com/objects/2> <http://example.com/predicates/2> "Bar" .
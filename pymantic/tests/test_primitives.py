@@ -12,6 +12,10 @@ def test_to_curie_multi_match():
     print curie
     assert curie == 'long:b' 
 
+def test_typed_literal_to_nt():
+    lit = Literal("42", datatype=NamedNode("http://www.w3.org/2001/XMLSchema#integer"))
+    assert lit.toNT() == '"42"^^<http://www.w3.org/2001/XMLSchema#integer>'
+
 def test_simple_add():
     t = Triple(NamedNode("http://example.com"), NamedNode("http://purl.org/dc/terms/issued"),en("Never!"))
     g = Graph()